@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+"""Compare JSON decoders and event loops on recorded chat traffic.
+
+    python benchmarks/bench_backends.py [RECORDING] [--repeat N]
+
+Without RECORDING a synthetic recording of model status frames is used.
+"""
+import json
+import sys
+import tempfile
+from argparse import ArgumentParser
+from pathlib import Path
+from random import randint
+from time import perf_counter
+from urllib.parse import quote
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from myfreecams import backends  # noqa: E402
+from myfreecams.chatrecorder import ChatRecorder, ChatReplay, read_frames  # noqa: E402
+from myfreecams.mfcwschat import MfcWsChat  # noqa: E402
+
+
+def synthetic_recording(path: Path, frames: int = 20000):
+    with ChatRecorder(path) as recorder:
+        for i in range(frames):
+            payload = {
+                "lv": 4,
+                "nm": f"model_{i % 500}",
+                "uid": 1000 + i % 500,
+                "vs": randint(0, 1) * 90,
+                "u": {"camserv": randint(400, 1200), "chat_opt": 1, "rank": 0},
+                "m": {"flags": 16, "new_model": 0, "topic": "hello%20world"},
+            }
+            text = f"10 0 0 0 0 {quote(json.dumps(payload))}"
+            recorder.record(f"{len(text):06d}{text}", timestamp=i * 0.01)
+
+
+def bench_decode(frames, repeat: int):
+    results = {}
+    for name in ("json", "orjson"):
+        try:
+            backends.use_json_backend(name)
+        except ValueError:
+            continue
+        best = None
+        for _ in range(repeat):
+            start = perf_counter()
+            count = 0
+            for _, data in frames:
+                count += len(MfcWsChat.parse_frame(data))
+            elapsed = perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        results[name] = count / best
+    return results
+
+
+async def replay(path: Path) -> int:
+    chat = ChatReplay(path, speed=None)
+    await chat.connect()
+    count = 0
+    async for message in chat:
+        if not message:
+            break
+        count += 1
+    return count
+
+
+def bench_loop(path: Path, repeat: int):
+    results = {}
+    for name in ("asyncio", "uvloop"):
+        try:
+            loop = backends.new_event_loop(name)
+        except ValueError:
+            continue
+        try:
+            best = None
+            for _ in range(repeat):
+                start = perf_counter()
+                count = loop.run_until_complete(replay(path))
+                elapsed = perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            results[name] = count / best
+        finally:
+            loop.close()
+    return results
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("recording", nargs="?")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(args.recording) if args.recording else Path(tmp) / "chat.rec"
+        if not args.recording:
+            synthetic_recording(path)
+        frames = list(read_frames(path))
+        print(f"{len(frames)} frames from {path}")
+        for name, rate in bench_decode(frames, args.repeat).items():
+            print(f"decode  {name:8} {rate:12,.0f} msg/s")
+        backends.use_json_backend()
+        for name, rate in bench_loop(path, args.repeat).items():
+            print(f"replay  {name:8} {rate:12,.0f} msg/s")
+
+
+if __name__ == "__main__":
+    main()
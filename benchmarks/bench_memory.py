@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+"""Track RSS against the number of models seen by the grabber.
+
+    python benchmarks/bench_memory.py [--models N] [--step N] [--ttl SECONDS]
+
+Feeds offline status messages for an ever growing set of model names
+through MfcGrabber.handle_model and evicts idle loaders like
+progress_log does. Run with --ttl -1 to keep every loader (old behavior).
+"""
+import asyncio
+import gc
+import sys
+from argparse import ArgumentParser
+from pathlib import Path
+from time import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from myfreecams.mfcgrabber import MfcGrabber  # noqa: E402
+from myfreecams.mfcwschat import Message  # noqa: E402
+
+
+def rss_kb() -> int:
+    try:
+        with open("/proc/self/statm") as fd:
+            pages = int(fd.read().split()[1])
+        return pages * 4096 // 1024
+    except OSError:
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+async def run(models: int, step: int, ttl: float):
+    grabber = await MfcGrabber.create()
+    grabber.loader_idle_ttl = ttl if ttl >= 0 else None
+    clock = time()
+    print(f"{'models seen':>12} {'loaders':>8} {'rss KB':>10}")
+    try:
+        for seen in range(step, models + step, step):
+            for i in range(seen - step, seen):
+                payload = {"nm": f"model_{i}", "uid": i, "vs": 90}
+                await grabber.handle_model(Message(10, 0, 0, 0, 0, payload=payload))
+            # pretend a minute passed between batches
+            clock += 60
+            grabber.evict_idle_loaders(now=clock)
+            gc.collect()
+            print(f"{seen:>12} {len(grabber.streams):>8} {rss_kb():>10}")
+    finally:
+        await grabber.stop()
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--models", type=int, default=50000)
+    parser.add_argument("--step", type=int, default=5000)
+    parser.add_argument("--ttl", type=float, default=30)
+    args = parser.parse_args()
+    asyncio.run(run(args.models, args.step, args.ttl))
+
+
+if __name__ == "__main__":
+    main()
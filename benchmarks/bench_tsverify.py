@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""Measure segment verification cost and the loop lag it causes.
+
+    python benchmarks/bench_tsverify.py [--streams N] [--seconds S]
+
+Verifies synthetic 2 MB segments (video + audio PID, PES starts with
+adaptation fields) with the per-packet reference check and with
+verify_segment. It then runs verify_segment in the grabber's thread pool
+for N streams, one segment per stream every two seconds, while
+Diagnostics samples the event loop lag.
+"""
+import asyncio
+import sys
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from myfreecams.diagnostics import Diagnostics  # noqa: E402
+from myfreecams.tsverify import (  # noqa: E402
+    TS_PACKET_SIZE,
+    count_continuity_errors,
+    verify_segment,
+)
+
+
+def synthetic_segment(size: int = 2 * 1024 * 1024) -> bytes:
+    packets = []
+    counters = {0x100: 0, 0x101: 0}
+    for i in range(size // TS_PACKET_SIZE):
+        pid = 0x101 if i % 8 == 0 else 0x100
+        cc = counters[pid]
+        counters[pid] = (cc + 1) & 0x0F
+        if i % 40 in (0, 1):
+            # PES start with random_access_indicator
+            stream_id = 0xC0 if pid == 0x101 else 0xE0
+            header = bytes([0x47, 0x40 | (pid >> 8), pid & 0xFF, 0x30 | cc])
+            body = bytes([1, 0x40]) + b"\x00\x00\x01" + bytes([stream_id])
+        else:
+            header = bytes([0x47, pid >> 8, pid & 0xFF, 0x10 | cc])
+            body = b""
+        packets.append(header + body + b"\xff" * (TS_PACKET_SIZE - 4 - len(body)))
+    return b"".join(packets)
+
+
+def best_of(func, *args, repeat: int = 20) -> float:
+    best = None
+    for _ in range(repeat):
+        start = perf_counter()
+        func(*args)
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+async def load(segment: bytes, streams: int, seconds: float) -> Diagnostics:
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="verify")
+    diagnostics = Diagnostics(interval=0.01, report_interval=3600)
+    diagnostics.start()
+    try:
+        end = loop.time() + seconds
+        while loop.time() < end:
+            await asyncio.gather(
+                *(
+                    loop.run_in_executor(executor, verify_segment, segment)
+                    for _ in range(streams)
+                ),
+                asyncio.sleep(2),
+            )
+    finally:
+        await diagnostics.stop()
+        executor.shutdown()
+    return diagnostics
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--streams", type=int, default=50)
+    parser.add_argument("--seconds", type=float, default=10)
+    args = parser.parse_args()
+    segment = synthetic_segment()
+    report = verify_segment(segment)
+    assert report.ok and len(report.keyframes) > 0
+    view = memoryview(segment)
+    reference = best_of(count_continuity_errors, view)
+    fast = best_of(verify_segment, segment)
+    print(f"{len(segment)} bytes, {report.packets} packets")
+    print(f"per-packet continuity check  {reference * 1000:7.2f} ms")
+    print(f"verify_segment               {fast * 1000:7.2f} ms")
+    diagnostics = asyncio.run(load(segment, args.streams, args.seconds))
+    print(f"{args.streams} streams: {diagnostics.status}")
+
+
+if __name__ == "__main__":
+    main()
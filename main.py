@@ -1,19 +1,128 @@
 #!/usr/bin/env python
 import asyncio
+import logging
 from myfreecams.mfcgrabber import MfcGrabber
+from myfreecams.chatrecorder import ChatRecorder, ChatReplay
+from myfreecams.daemon import GrabberDaemon
+from myfreecams.logsetup import setup_logging, stop_logging
+from myfreecams.diagnostics import Diagnostics
+from myfreecams import backends
+from myfreecams.hlsserver import HlsServer
 from argparse import ArgumentParser
 
 
 def main():
     parser = ArgumentParser()
-    parser.add_argument("models", nargs="+")
+    parser.add_argument("models", nargs="*")
+    parser.add_argument(
+        "--config",
+        metavar="FILE",
+        help="run as a daemon, reloading FILE on SIGHUP or when it changes",
+    )
+    parser.add_argument(
+        "--record", metavar="FILE", help="save raw chat frames to FILE"
+    )
+    parser.add_argument(
+        "--replay", metavar="FILE", help="feed the grabber from a chat recording"
+    )
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=1.0,
+        help="replay speed multiplier, 0 replays as fast as possible",
+    )
+    parser.add_argument(
+        "--diagnostics",
+        metavar="DIR",
+        help="monitor loop lag; SIGUSR1/SIGUSR2 dump cProfile/tracemalloc to DIR",
+    )
+    parser.add_argument(
+        "--hls-port",
+        type=int,
+        help="re-serve active captures as live HLS on 127.0.0.1:PORT",
+    )
+    parser.add_argument(
+        "--hls-buffer",
+        type=int,
+        default=10,
+        metavar="SEGMENTS",
+        help="segments kept in memory per stream for --hls-port",
+    )
+    parser.add_argument(
+        "--json-backend",
+        choices=["orjson", "json"],
+        help="chat payload decoder, default: orjson if installed",
+    )
+    parser.add_argument(
+        "--loop",
+        choices=["uvloop", "asyncio"],
+        help="event loop implementation, default: uvloop if installed",
+    )
+    parser.add_argument(
+        "--log-level",
+        default="INFO",
+        choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+    )
+    parser.add_argument(
+        "--log-rate-limit",
+        type=float,
+        default=30.0,
+        metavar="SECONDS",
+        help="let one copy of a repeated warning through per SECONDS, 0 disables",
+    )
     args = parser.parse_args()
-    loop = asyncio.get_event_loop()
-    grabber = loop.run_until_complete(MfcGrabber.create(models=args.models))
+    if not args.models and not args.config:
+        parser.error("either models or --config is required")
+    setup_logging(getattr(logging, args.log_level), rate_limit=args.log_rate_limit)
     try:
-        loop.run_until_complete(grabber.grab())
+        run(args)
+    finally:
+        stop_logging()
+
+
+def run(args):
+    backends.use_json_backend(args.json_backend)
+    loop = backends.new_event_loop(args.loop)
+    asyncio.set_event_loop(loop)
+    logging.getLogger(__name__).info(
+        f"Using {backends.json_backend} decoder on {type(loop).__module__} loop"
+    )
+    if args.config:
+        daemon = GrabberDaemon(args.config)
+        try:
+            loop.run_until_complete(daemon.run())
+        except KeyboardInterrupt:
+            loop.run_until_complete(daemon.stop())
+        return
+    chat = ChatReplay(args.replay, speed=args.speed) if args.replay else None
+    diagnostics = Diagnostics(args.diagnostics) if args.diagnostics else None
+    grabber = loop.run_until_complete(
+        MfcGrabber.create(models=args.models, chat=chat, diagnostics=diagnostics)
+    )
+    hls_server = None
+    if args.hls_port:
+        grabber.buffer_segments = args.hls_buffer
+        hls_server = HlsServer(
+            grabber.streams, port=args.hls_port, diagnostics=diagnostics
+        )
+        loop.run_until_complete(hls_server.start())
+    recorder = None
+    if args.record and chat is None:
+        recorder = ChatRecorder(args.record)
+        grabber.chat.recorder = recorder
+    try:
+        if chat is not None:
+            loop.run_until_complete(grabber.replay())
+        else:
+            loop.run_until_complete(grabber.grab())
     except KeyboardInterrupt:
+        pass
+    finally:
+        if hls_server is not None:
+            loop.run_until_complete(hls_server.stop())
         loop.run_until_complete(grabber.stop())
+        if recorder is not None:
+            recorder.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,59 @@
+import asyncio
+import json
+import logging
+from typing import Any, Callable, Optional
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+try:
+    import uvloop
+except ImportError:  # pragma: no cover - optional dependency
+    uvloop = None
+
+logger = logging.getLogger(__name__)
+
+# orjson.JSONDecodeError subclasses json.JSONDecodeError
+JSONDecodeError = json.JSONDecodeError
+
+json_loads: Callable[[str], Any] = json.loads
+json_backend = "json"
+
+
+def use_json_backend(name: Optional[str] = None) -> str:
+    """Select the JSON decoder used for chat payloads.
+
+    ``None`` picks orjson when it is installed and falls back to the
+    stdlib otherwise. Returns the name of the selected backend.
+    """
+    global json_loads, json_backend
+    if name is None:
+        name = "orjson" if orjson is not None else "json"
+    if name == "orjson":
+        if orjson is None:
+            raise ValueError("orjson is not installed")
+        json_loads = orjson.loads
+    elif name == "json":
+        json_loads = json.loads
+    else:
+        raise ValueError(f"Unknown JSON backend {name}")
+    json_backend = name
+    return name
+
+
+def new_event_loop(name: Optional[str] = None) -> asyncio.AbstractEventLoop:
+    """Create an event loop, uvloop when available unless ``name`` says otherwise."""
+    if name is None:
+        name = "uvloop" if uvloop is not None else "asyncio"
+    if name == "uvloop":
+        if uvloop is None:
+            raise ValueError("uvloop is not installed")
+        return uvloop.new_event_loop()
+    if name == "asyncio":
+        return asyncio.new_event_loop()
+    raise ValueError(f"Unknown event loop {name}")
+
+
+use_json_backend()
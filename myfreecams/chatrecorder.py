@@ -0,0 +1,148 @@
+import asyncio
+import gzip
+import struct
+from pathlib import Path
+from time import time, monotonic
+from typing import BinaryIO, Deque, Iterator, Optional, Tuple, Union
+from collections import deque
+from .mfcwschat import MfcWsChat, Message
+
+# File layout: MAGIC, then one record per websocket frame:
+#   <float64 unix timestamp><uint32 payload length><utf-8 payload>
+# Files with a ".gz" suffix are transparently gzip-compressed.
+MAGIC = b"MFCREC1\n"
+FRAME_HEADER = struct.Struct("<dI")
+
+
+class RecordingFormatError(Exception):
+    pass
+
+
+def _open(path: Union[str, Path], mode: str) -> BinaryIO:
+    path = Path(path)
+    if path.suffix == ".gz":
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+
+def read_frames(path: Union[str, Path]) -> Iterator[Tuple[float, str]]:
+    with _open(path, "rb") as fd:
+        if fd.read(len(MAGIC)) != MAGIC:
+            raise RecordingFormatError(f"{path} is not a chat recording")
+        while True:
+            header = fd.read(FRAME_HEADER.size)
+            if not header:
+                return
+            if len(header) < FRAME_HEADER.size:
+                raise RecordingFormatError(f"{path}: truncated frame header")
+            timestamp, length = FRAME_HEADER.unpack(header)
+            data = fd.read(length)
+            if len(data) < length:
+                raise RecordingFormatError(f"{path}: truncated frame")
+            yield timestamp, data.decode("utf-8")
+
+
+class ChatRecorder(object):
+    path: Path
+    fd: Optional[BinaryIO]
+    frames: int
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.fd = None
+        self.frames = 0
+
+    def open(self):
+        if self.fd is None:
+            self.fd = _open(self.path, "wb")
+            self.fd.write(MAGIC)
+
+    def record(self, data: str, timestamp: Optional[float] = None):
+        if self.fd is None:
+            self.open()
+        raw = data.encode("utf-8")
+        if timestamp is None:
+            timestamp = time()
+        self.fd.write(FRAME_HEADER.pack(timestamp, len(raw)))
+        self.fd.write(raw)
+        self.frames += 1
+
+    def close(self):
+        if self.fd is not None:
+            self.fd.close()
+            self.fd = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ChatReplay(object):
+    """Drop-in replacement for MfcWsChat that replays a recorded session.
+
+    ``speed`` scales the recorded inter-frame delays: 1.0 is real time,
+    N replays N times faster, None (or 0) replays as fast as possible.
+    """
+
+    path: Path
+    speed: Optional[float]
+    user_session_id: int
+    user_session_name: Optional[str]
+    messages_buffer: Deque[Message]
+    frames: Optional[Iterator[Tuple[float, str]]]
+    sent_messages: int
+
+    def __init__(self, path: Union[str, Path], speed: Optional[float] = 1.0):
+        self.path = Path(path)
+        self.speed = speed or None
+        self.user_session_id = 0
+        self.user_session_name = None
+        self.messages_buffer = deque()
+        self.frames = None
+        self.sent_messages = 0
+        self._first_ts = 0.0
+        self._started = 0.0
+
+    @property
+    def connected(self):
+        return self.frames is not None
+
+    async def connect(self, ws_server: Optional[str] = None):
+        self.frames = read_frames(self.path)
+        self._first_ts = 0.0
+        self._started = monotonic()
+
+    async def disconnect(self):
+        if self.frames is not None:
+            self.frames.close()
+            self.frames = None
+
+    async def send_message(self, message: str):
+        # lookups and pings have nowhere to go during a replay
+        self.sent_messages += 1
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        # frames without messages are skipped, None would end the dispatch
+        while not self.messages_buffer:
+            if not self.connected:
+                raise StopAsyncIteration
+            try:
+                timestamp, data = next(self.frames)
+            except StopIteration:
+                await self.disconnect()
+                raise StopAsyncIteration
+            if not self._first_ts:
+                self._first_ts = timestamp
+            if self.speed is not None:
+                delay = (timestamp - self._first_ts) / self.speed
+                delay -= monotonic() - self._started
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            self.messages_buffer.extend(MfcWsChat.parse_frame(data))
+        return self.messages_buffer.popleft()
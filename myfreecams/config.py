@@ -0,0 +1,68 @@
+import json
+from dataclasses import dataclass, field, fields
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+
+class ConfigError(Exception):
+    pass
+
+
+@dataclass
+class GrabberConfig:
+    models: List[str] = field(default_factory=list)
+    max_captures: Optional[int] = None
+    max_bytes_per_second: Optional[float] = None
+    preempt: bool = False
+    priorities: Dict[str, int] = field(default_factory=dict)
+    start_policy: Union[str, float] = "full"
+    fetch_backlog: bool = False
+    # SQLite lease database shared by grabbers on this machine
+    lease_db: Optional[str] = None
+    lease_ttl: float = 30
+    host_id: Optional[str] = None
+    # enables loop lag monitoring; profiles and snapshots are written here
+    diagnostics_dir: Optional[str] = None
+    # idle stream loaders are dropped after this many seconds
+    loader_idle_ttl: Optional[float] = 600
+    # storage: captures are written to work_dir and moved to archive_dir
+    work_dir: str = "."
+    archive_dir: Optional[str] = None
+    max_file_size: Optional[int] = None
+    max_file_duration: Optional[float] = None
+    preallocate: int = 0
+    min_free_bytes: int = 0
+    reserve_free_bytes: int = 0
+    move_bytes_per_second: Optional[float] = None
+    # local HLS re-serving of active captures, disabled without a port
+    hls_host: str = "127.0.0.1"
+    hls_port: Optional[int] = None
+    hls_buffer_segments: int = 10
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "GrabberConfig":
+        if not isinstance(data, dict):
+            raise ConfigError("Config root must be an object")
+        known = {f.name for f in fields(cls)}
+        unknown = set(data) - known
+        if unknown:
+            raise ConfigError(f"Unknown config keys: {', '.join(sorted(unknown))}")
+        config = cls(**data)
+        if not isinstance(config.models, list):
+            raise ConfigError("'models' must be a list of model names")
+        config.models = [str(m).lower() for m in config.models]
+        policy = config.start_policy
+        if policy not in ("full", "live") and not (
+            isinstance(policy, (int, float)) and policy >= 0
+        ):
+            raise ConfigError("'start_policy' must be 'full', 'live' or seconds")
+        return config
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> "GrabberConfig":
+        try:
+            with open(path) as fd:
+                data = json.load(fd)
+        except (OSError, json.JSONDecodeError) as e:
+            raise ConfigError(f"Cannot read config {path}: {e}")
+        return cls.from_dict(data)
@@ -0,0 +1,316 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import sqlite3
+from abc import ABC, abstractmethod
+from concurrent.futures import Executor
+from dataclasses import dataclass
+from pathlib import Path
+from time import time
+from typing import Callable, Dict, Optional, Set, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Lease:
+    model: str
+    owner: str
+    expires_at: float
+
+    @property
+    def expired(self) -> bool:
+        return self.expires_at <= time()
+
+
+class LeaseBackend(ABC):
+    @abstractmethod
+    async def acquire(self, model: str, owner: str, ttl: float) -> bool:
+        ...
+
+    @abstractmethod
+    async def renew(self, model: str, owner: str, ttl: float) -> bool:
+        ...
+
+    @abstractmethod
+    async def release(self, model: str, owner: str) -> None:
+        ...
+
+    @abstractmethod
+    async def get(self, model: str) -> Optional[Lease]:
+        ...
+
+
+class SqliteLeaseBackend(LeaseBackend):
+    """Leases shared by grabber processes on one machine.
+
+    Every call runs in its own ``BEGIN IMMEDIATE`` transaction, so SQLite's
+    file lock serialises competing hosts. Calls are made in an executor.
+    """
+
+    path: Path
+    executor: Optional[Executor]
+
+    def __init__(self, path: Union[str, Path], executor: Optional[Executor] = None):
+        self.path = Path(path)
+        self.executor = executor
+        db = self.connect()
+        try:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS leases ("
+                "model TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+        finally:
+            db.close()
+
+    def connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=10, isolation_level=None)
+
+    async def run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    def _acquire(self, model: str, owner: str, ttl: float) -> bool:
+        db = self.connect()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            row = db.execute(
+                "SELECT owner, expires_at FROM leases WHERE model = ?", (model,)
+            ).fetchone()
+            now = time()
+            if row is not None and row[0] != owner and row[1] > now:
+                db.execute("ROLLBACK")
+                return False
+            db.execute(
+                "INSERT OR REPLACE INTO leases VALUES (?, ?, ?)",
+                (model, owner, now + ttl),
+            )
+            db.execute("COMMIT")
+            return True
+        finally:
+            db.close()
+
+    def _renew(self, model: str, owner: str, ttl: float) -> bool:
+        db = self.connect()
+        try:
+            cursor = db.execute(
+                "UPDATE leases SET expires_at = ? WHERE model = ? AND owner = ?",
+                (time() + ttl, model, owner),
+            )
+            return cursor.rowcount == 1
+        finally:
+            db.close()
+
+    def _release(self, model: str, owner: str):
+        db = self.connect()
+        try:
+            db.execute(
+                "DELETE FROM leases WHERE model = ? AND owner = ?", (model, owner)
+            )
+        finally:
+            db.close()
+
+    def _get(self, model: str) -> Optional[Lease]:
+        db = self.connect()
+        try:
+            row = db.execute(
+                "SELECT owner, expires_at FROM leases WHERE model = ?", (model,)
+            ).fetchone()
+        finally:
+            db.close()
+        return Lease(model, *row) if row is not None else None
+
+    async def acquire(self, model: str, owner: str, ttl: float) -> bool:
+        return await self.run(self._acquire, model, owner, ttl)
+
+    async def renew(self, model: str, owner: str, ttl: float) -> bool:
+        return await self.run(self._renew, model, owner, ttl)
+
+    async def release(self, model: str, owner: str) -> None:
+        await self.run(self._release, model, owner)
+
+    async def get(self, model: str) -> Optional[Lease]:
+        return await self.run(self._get, model)
+
+
+class LeaseStore(ABC):
+    """Minimal interface of a shared network key-value store.
+
+    Values carry a version; writes are compare-and-set on that version
+    (``None`` means the key must not exist yet).
+    """
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[Tuple[str, int]]:
+        ...
+
+    @abstractmethod
+    async def compare_and_set(
+        self, key: str, value: str, version: Optional[int]
+    ) -> bool:
+        ...
+
+    @abstractmethod
+    async def delete(self, key: str, version: int) -> bool:
+        ...
+
+
+class MemoryLeaseStore(LeaseStore):
+    data: Dict[str, Tuple[str, int]]
+
+    def __init__(self):
+        self.data = {}
+
+    async def get(self, key: str) -> Optional[Tuple[str, int]]:
+        return self.data.get(key)
+
+    async def compare_and_set(
+        self, key: str, value: str, version: Optional[int]
+    ) -> bool:
+        current = self.data.get(key)
+        current_version = current[1] if current is not None else None
+        if current_version != version:
+            return False
+        self.data[key] = (value, (version or 0) + 1)
+        return True
+
+    async def delete(self, key: str, version: int) -> bool:
+        current = self.data.get(key)
+        if current is None or current[1] != version:
+            return False
+        del self.data[key]
+        return True
+
+
+class StoreLeaseBackend(LeaseBackend):
+    store: LeaseStore
+    prefix: str
+
+    def __init__(self, store: LeaseStore, prefix: str = "mfc/lease/"):
+        self.store = store
+        self.prefix = prefix
+
+    async def read(self, model: str) -> Tuple[Optional[Lease], Optional[int]]:
+        entry = await self.store.get(self.prefix + model)
+        if entry is None:
+            return None, None
+        value, version = entry
+        data = json.loads(value)
+        return Lease(model, data["owner"], data["expires_at"]), version
+
+    async def write(self, model: str, owner: str, ttl: float, version) -> bool:
+        value = json.dumps({"owner": owner, "expires_at": time() + ttl})
+        return await self.store.compare_and_set(self.prefix + model, value, version)
+
+    async def acquire(self, model: str, owner: str, ttl: float) -> bool:
+        lease, version = await self.read(model)
+        if lease is not None and lease.owner != owner and not lease.expired:
+            return False
+        return await self.write(model, owner, ttl, version)
+
+    async def renew(self, model: str, owner: str, ttl: float) -> bool:
+        lease, version = await self.read(model)
+        if lease is None or lease.owner != owner:
+            return False
+        return await self.write(model, owner, ttl, version)
+
+    async def release(self, model: str, owner: str) -> None:
+        lease, version = await self.read(model)
+        if lease is not None and lease.owner == owner:
+            await self.store.delete(self.prefix + model, version)
+
+    async def get(self, model: str) -> Optional[Lease]:
+        lease, _ = await self.read(model)
+        return lease
+
+
+class LeaseCoordinator(object):
+    """Makes sure only one host captures a model at a time.
+
+    Held leases are renewed every ``ttl / 3`` seconds. A host that sees a
+    model online while another host holds its lease keeps it in
+    ``waiting`` and takes over once that lease is released or expires.
+    """
+
+    backend: LeaseBackend
+    owner: str
+    ttl: float
+    held: Set[str]
+    waiting: Dict[str, Callable[[], None]]
+    on_lost: Optional[Callable[[str], None]]
+    renew_task: Optional[asyncio.Task]
+
+    def __init__(
+        self,
+        backend: LeaseBackend,
+        owner: Optional[str] = None,
+        ttl: float = 30,
+        on_lost: Optional[Callable[[str], None]] = None,
+    ):
+        self.backend = backend
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+        self.ttl = ttl
+        self.held = set()
+        self.waiting = {}
+        self.on_lost = on_lost
+        self.renew_task = None
+
+    async def acquire(self, model: str) -> bool:
+        if await self.backend.acquire(model, self.owner, self.ttl):
+            self.held.add(model)
+            self.waiting.pop(model, None)
+            return True
+        return False
+
+    def wait_for(self, model: str, on_acquired: Callable[[], None]):
+        self.waiting[model] = on_acquired
+
+    async def release(self, model: str):
+        self.waiting.pop(model, None)
+        if model in self.held:
+            self.held.discard(model)
+            await self.backend.release(model, self.owner)
+
+    def handover(self, model: str, on_acquired: Callable[[], None]):
+        # the capture failed here: free the lease for other hosts and try
+        # to take it back later like any other waiting host
+        async def handover():
+            await self.release(model)
+            self.wait_for(model, on_acquired)
+
+        asyncio.ensure_future(handover())
+
+    def start(self):
+        if self.renew_task is None:
+            self.renew_task = asyncio.create_task(self.renew_leases())
+
+    async def renew_leases(self):
+        try:
+            while True:
+                await asyncio.sleep(self.ttl / 3)
+                await self.refresh()
+        except asyncio.CancelledError:
+            pass
+
+    async def refresh(self):
+        for model in list(self.held):
+            if not await self.backend.renew(model, self.owner, self.ttl):
+                logger.warning(f"Lease for {model} lost")
+                self.held.discard(model)
+                if self.on_lost is not None:
+                    self.on_lost(model)
+        for model, on_acquired in list(self.waiting.items()):
+            if await self.acquire(model):
+                logger.info(f"Lease for {model} taken over")
+                on_acquired()
+
+    async def stop(self):
+        if self.renew_task is not None:
+            self.renew_task.cancel()
+            await self.renew_task
+            self.renew_task = None
+        self.waiting.clear()
+        for model in list(self.held):
+            await self.release(model)
@@ -0,0 +1,179 @@
+import asyncio
+import logging
+import signal
+from dataclasses import replace
+from pathlib import Path
+from typing import List, Optional, Set, Tuple, Union
+from .config import GrabberConfig, ConfigError
+from .mfcgrabber import MfcGrabber
+from .coordination import LeaseCoordinator, SqliteLeaseBackend
+from .diagnostics import Diagnostics
+from .storage import StorageManager
+from .hlsserver import HlsServer
+
+logger = logging.getLogger(__name__)
+
+# only read when the daemon starts, a reload cannot change them
+RESTART_KEYS = (
+    "lease_db",
+    "lease_ttl",
+    "host_id",
+    "diagnostics_dir",
+    "work_dir",
+    "archive_dir",
+    "max_file_size",
+    "max_file_duration",
+    "preallocate",
+    "min_free_bytes",
+    "reserve_free_bytes",
+    "move_bytes_per_second",
+    "hls_host",
+    "hls_port",
+)
+
+
+class GrabberDaemon(object):
+
+    config_path: Path
+    config: GrabberConfig
+    grabber: Optional[MfcGrabber]
+    poll_interval: float
+    watch_task: Optional[asyncio.Task]
+    hls_server: Optional[HlsServer]
+
+    def __init__(self, config_path: Union[str, Path], poll_interval: float = 5.0):
+        self.config_path = Path(config_path)
+        self.config = GrabberConfig.load(self.config_path)
+        self.poll_interval = poll_interval
+        self.grabber = None
+        self.watch_task = None
+        self.hls_server = None
+        self._mtime = self.get_mtime()
+
+    def get_mtime(self) -> float:
+        try:
+            return self.config_path.stat().st_mtime
+        except OSError:
+            return 0
+
+    @staticmethod
+    def diff_models(old: GrabberConfig, new: GrabberConfig) -> Tuple[Set, Set]:
+        old_models = set(old.models)
+        new_models = set(new.models)
+        return new_models - old_models, old_models - new_models
+
+    @staticmethod
+    def diff_restart_keys(old: GrabberConfig, new: GrabberConfig) -> List[str]:
+        return [key for key in RESTART_KEYS if getattr(old, key) != getattr(new, key)]
+
+    def apply_grabber_config(self, grabber: MfcGrabber):
+        grabber.governor.configure(
+            max_captures=self.config.max_captures,
+            max_bytes_per_second=self.config.max_bytes_per_second,
+            preempt=self.config.preempt,
+            priorities=self.config.priorities,
+        )
+        buffer_segments = self.config.hls_buffer_segments if self.config.hls_port else 0
+        grabber.configure_loaders(
+            self.config.start_policy, self.config.fetch_backlog, buffer_segments
+        )
+        grabber.loader_idle_ttl = self.config.loader_idle_ttl
+
+    async def run(self):
+        coordinator = None
+        if self.config.lease_db:
+            coordinator = LeaseCoordinator(
+                SqliteLeaseBackend(self.config.lease_db),
+                owner=self.config.host_id,
+                ttl=self.config.lease_ttl,
+            )
+        diagnostics = None
+        if self.config.diagnostics_dir:
+            diagnostics = Diagnostics(self.config.diagnostics_dir)
+        storage = StorageManager(
+            self.config.work_dir,
+            archive_dir=self.config.archive_dir,
+            max_file_size=self.config.max_file_size,
+            max_file_duration=self.config.max_file_duration,
+            preallocate=self.config.preallocate,
+            min_free_bytes=self.config.min_free_bytes,
+            reserve_free_bytes=self.config.reserve_free_bytes,
+            move_bytes_per_second=self.config.move_bytes_per_second,
+        )
+        self.grabber = await MfcGrabber.create(
+            models=self.config.models,
+            storage=storage,
+            coordinator=coordinator,
+            diagnostics=diagnostics,
+        )
+        self.apply_grabber_config(self.grabber)
+        if self.config.hls_port:
+            self.hls_server = HlsServer(
+                self.grabber.streams,
+                host=self.config.hls_host,
+                port=self.config.hls_port,
+                diagnostics=diagnostics,
+            )
+            await self.hls_server.start()
+        loop = asyncio.get_running_loop()
+        try:
+            loop.add_signal_handler(
+                signal.SIGHUP, lambda: asyncio.ensure_future(self.reload())
+            )
+        except (AttributeError, NotImplementedError):
+            logger.info("SIGHUP is not available, relying on file watching")
+        self.watch_task = asyncio.create_task(self.watch())
+        try:
+            await self.grabber.grab()
+        finally:
+            await self.stop()
+
+    async def watch(self):
+        try:
+            while True:
+                await asyncio.sleep(self.poll_interval)
+                mtime = self.get_mtime()
+                if mtime != self._mtime:
+                    self._mtime = mtime
+                    await self.reload()
+        except asyncio.CancelledError:
+            pass
+
+    async def reload(self):
+        try:
+            config = GrabberConfig.load(self.config_path)
+        except ConfigError as e:
+            logger.warning(f"{e}, keeping current config")
+            return
+        added, removed = self.diff_models(self.config, config)
+        if self.grabber is None:
+            self.config = config
+            return
+        changed = self.diff_restart_keys(self.config, config)
+        if changed:
+            logger.warning(f"Restart to apply changes to: {', '.join(changed)}")
+            # keep describing what is actually running
+            config = replace(config, **{k: getattr(self.config, k) for k in changed})
+        self.config = config
+        self.apply_grabber_config(self.grabber)
+        if removed:
+            logger.info(f"Stop tracking: {', '.join(sorted(removed))}")
+            self.grabber.remove_models(removed)
+        if added:
+            logger.info(f"Start tracking: {', '.join(sorted(added))}")
+            await self.grabber.add_models(added)
+
+    async def stop(self):
+        try:
+            asyncio.get_running_loop().remove_signal_handler(signal.SIGHUP)
+        except (AttributeError, NotImplementedError):
+            pass
+        if self.watch_task is not None:
+            self.watch_task.cancel()
+            await self.watch_task
+            self.watch_task = None
+        if self.hls_server is not None:
+            await self.hls_server.stop()
+            self.hls_server = None
+        if self.grabber is not None:
+            await self.grabber.stop()
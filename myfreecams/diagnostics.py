@@ -0,0 +1,260 @@
+import asyncio
+import cProfile
+import functools
+import logging
+import signal
+import sys
+import threading
+import traceback
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+from time import monotonic, perf_counter
+from typing import Coroutine, Dict, List, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+
+class Timing(object):
+    # wall time includes time spent suspended in awaits, busy time only
+    # the stretches the coroutine itself ran on the loop thread
+    __slots__ = ("calls", "total", "max", "busy_total", "busy_max")
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.busy_total = 0.0
+        self.busy_max = 0.0
+
+    def add(self, duration: float, busy: float):
+        self.calls += 1
+        self.total += duration
+        if duration > self.max:
+            self.max = duration
+        self.busy_total += busy
+        if busy > self.busy_max:
+            self.busy_max = busy
+
+    def __str__(self) -> str:
+        calls = self.calls or 1
+        return (
+            f"n={self.calls} "
+            f"wall avg={self.total / calls * 1000:.2f}ms max={self.max * 1000:.2f}ms "
+            f"busy avg={self.busy_total / calls * 1000:.2f}ms "
+            f"max={self.busy_max * 1000:.2f}ms"
+        )
+
+
+timings: Dict[str, Timing] = {}
+
+
+class TimedCoroutine(object):
+    """Drives a coroutine step by step, timing each ``send``/``throw``."""
+
+    __slots__ = ("coro", "timing")
+
+    def __init__(self, coro: Coroutine, timing: Timing):
+        self.coro = coro
+        self.timing = timing
+
+    def __await__(self):
+        coro = self.coro
+        start = perf_counter()
+        busy = 0.0
+        value = None
+        error: Optional[BaseException] = None
+        try:
+            while True:
+                step = perf_counter()
+                try:
+                    if error is None:
+                        future = coro.send(value)
+                    else:
+                        future, error = coro.throw(error), None
+                except StopIteration as stop:
+                    return stop.value
+                finally:
+                    busy += perf_counter() - step
+                try:
+                    value = yield future
+                except GeneratorExit:
+                    coro.close()
+                    raise
+                except BaseException as e:
+                    value, error = None, e
+        finally:
+            self.timing.add(perf_counter() - start, busy)
+
+
+def timed(name: str):
+    """Record wall and busy time of every call to a coroutine function."""
+
+    timing = timings.setdefault(name, Timing())
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            return await TimedCoroutine(func(*args, **kwargs), timing)
+
+        return wrapper
+
+    return decorator
+
+
+class Diagnostics(object):
+    """Loop lag sampling, stall detection and on-demand profiling.
+
+    A sampler task measures how late the loop wakes up from a short sleep.
+    A watchdog thread notices when the sampler stops ticking and logs the
+    stack the loop thread is stuck in. SIGUSR1 starts/stops cProfile and
+    SIGUSR2 starts tracemalloc/writes a snapshot; dumps go to ``dump_dir``.
+    """
+
+    dump_dir: Path
+    interval: float
+    stall_threshold: float
+    report_interval: float
+    lag_max: float
+    lag_total: float
+    lag_samples: int
+    stalls: int
+    profiler: Optional[cProfile.Profile]
+    sampler_task: Optional[asyncio.Task]
+
+    def __init__(
+        self,
+        dump_dir: Union[str, Path] = ".",
+        interval: float = 0.5,
+        stall_threshold: float = 0.25,
+        report_interval: float = 60,
+    ):
+        self.dump_dir = Path(dump_dir)
+        self.interval = interval
+        self.stall_threshold = stall_threshold
+        self.report_interval = report_interval
+        self.reset_lag()
+        self.stalls = 0
+        self.profiler = None
+        self.sampler_task = None
+        self._heartbeat = monotonic()
+        self._loop_thread_id = 0
+        self._stop = threading.Event()
+        self._watchdog: Optional[threading.Thread] = None
+        self._signals: List[int] = []
+
+    def reset_lag(self):
+        self.lag_max = 0.0
+        self.lag_total = 0.0
+        self.lag_samples = 0
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = monotonic()
+        self.sampler_task = asyncio.create_task(self.sample_lag())
+        self._stop.clear()
+        self._watchdog = threading.Thread(
+            target=self.watch_loop, name="loop-watchdog", daemon=True
+        )
+        self._watchdog.start()
+        for signum, handler in (
+            (getattr(signal, "SIGUSR1", None), self.toggle_profile),
+            (getattr(signal, "SIGUSR2", None), self.snapshot_memory),
+        ):
+            if signum is None:
+                continue
+            try:
+                loop.add_signal_handler(signum, handler)
+                self._signals.append(signum)
+            except (NotImplementedError, RuntimeError):
+                pass
+
+    async def stop(self):
+        loop = asyncio.get_running_loop()
+        for signum in self._signals:
+            loop.remove_signal_handler(signum)
+        self._signals = []
+        self._stop.set()
+        if self.sampler_task is not None:
+            self.sampler_task.cancel()
+            await self.sampler_task
+            self.sampler_task = None
+        if self.profiler is not None:
+            self.toggle_profile()
+
+    async def sample_lag(self):
+        loop = asyncio.get_running_loop()
+        last_report = loop.time()
+        try:
+            while True:
+                expected = loop.time() + self.interval
+                await asyncio.sleep(self.interval)
+                now = loop.time()
+                self._heartbeat = monotonic()
+                lag = max(0.0, now - expected)
+                self.lag_samples += 1
+                self.lag_total += lag
+                if lag > self.lag_max:
+                    self.lag_max = lag
+                if now - last_report >= self.report_interval:
+                    logger.info(self.status)
+                    self.reset_lag()
+                    last_report = now
+        except asyncio.CancelledError:
+            pass
+
+    def watch_loop(self):
+        reported = False
+        while not self._stop.wait(self.stall_threshold / 2):
+            stalled = monotonic() - self._heartbeat - self.interval
+            if stalled < self.stall_threshold:
+                reported = False
+                continue
+            if reported:
+                continue
+            reported = True
+            self.stalls += 1
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else ""
+            logger.warning(
+                f"Event loop blocked for {stalled:.3f}s, loop thread is in:\n{stack}"
+            )
+
+    @property
+    def status(self) -> str:
+        avg = self.lag_total / self.lag_samples if self.lag_samples else 0
+        parts = [
+            f"loop lag avg={avg * 1000:.1f}ms max={self.lag_max * 1000:.1f}ms",
+            f"stalls={self.stalls}",
+        ]
+        parts.extend(f"{name}: {timing}" for name, timing in sorted(timings.items()))
+        return "; ".join(parts)
+
+    def get_dump_path(self, prefix: str, suffix: str) -> Path:
+        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        self.dump_dir.mkdir(parents=True, exist_ok=True)
+        return self.dump_dir / f"{prefix}_{timestamp}.{suffix}"
+
+    def toggle_profile(self) -> Optional[Path]:
+        if self.profiler is None:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+            logger.info("cProfile started")
+            return None
+        self.profiler.disable()
+        path = self.get_dump_path("profile", "prof")
+        self.profiler.dump_stats(path)
+        self.profiler = None
+        logger.info(f"cProfile stopped, stats written to {path}")
+        return path
+
+    def snapshot_memory(self) -> Optional[Path]:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(10)
+            logger.info("tracemalloc started, signal again for a snapshot")
+            return None
+        path = self.get_dump_path("tracemalloc", "snapshot")
+        tracemalloc.take_snapshot().dump(str(path))
+        logger.info(f"tracemalloc snapshot written to {path}")
+        return path
@@ -0,0 +1,270 @@
+import asyncio
+import heapq
+import logging
+from collections import Counter
+from itertools import count
+from time import monotonic
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple, Union
+from yarl import URL
+from .streamloader import StreamLoader
+
+logger = logging.getLogger(__name__)
+
+
+class CaptureGovernor(object):
+    """Admission control for captures.
+
+    Caps the number of concurrent captures and the total download rate.
+    When no slot is free a capture waits in a priority queue, or, if
+    ``preempt`` is set, takes the slot of a lower-priority capture which
+    is then queued in its place.
+
+    With an ``admission`` check set, an admitted capture holds its slot in
+    ``starting`` until the check passes; a refused capture gives the slot
+    back to the queue.
+    """
+
+    max_captures: Optional[int]
+    max_bytes_per_second: Optional[float]
+    preempt: bool
+    priorities: Dict[str, int]
+    active: Dict[str, Tuple[StreamLoader, asyncio.Task]]
+    pending: Dict[str, Tuple[StreamLoader, URL, Optional[float]]]
+    starting: Dict[str, asyncio.Task]
+    queue: List[Tuple[int, int, str]]
+    metrics: Counter
+    # called when an admitted capture ends by itself, not via stop/cancel
+    on_finished: Optional[Callable[[StreamLoader], None]]
+    # awaited right before a capture starts, False refuses it
+    admission: Optional[
+        Callable[[StreamLoader, URL, Optional[float]], Awaitable[bool]]
+    ]
+    # called when a started or starting capture is stopped by the governor
+    on_stopped: Optional[Callable[[StreamLoader], None]]
+
+    def __init__(
+        self,
+        max_captures: Optional[int] = None,
+        max_bytes_per_second: Optional[float] = None,
+        preempt: bool = False,
+        priorities: Optional[Dict[str, int]] = None,
+    ):
+        self.active = {}
+        self.pending = {}
+        self.starting = {}
+        self.queue = []
+        self.metrics = Counter()
+        self.on_finished = None
+        self.admission = None
+        self.on_stopped = None
+        self._counter = count()
+        self._allowance = 0.0
+        self._last_refill = monotonic()
+        self.configure(max_captures, max_bytes_per_second, preempt, priorities)
+
+    def configure(
+        self,
+        max_captures: Optional[int] = None,
+        max_bytes_per_second: Optional[float] = None,
+        preempt: bool = False,
+        priorities: Optional[Dict[str, int]] = None,
+    ):
+        self.max_captures = max_captures
+        self.max_bytes_per_second = max_bytes_per_second
+        self.preempt = preempt
+        self.priorities = {k.lower(): v for k, v in (priorities or {}).items()}
+        self._allowance = max_bytes_per_second or 0.0
+        # queued models keep their place among equals under new priorities
+        self.queue = [(-self.priority(key), n, key) for _, n, key in self.queue]
+        heapq.heapify(self.queue)
+        self.admit_pending()
+
+    def priority(self, model_name: str) -> int:
+        return self.priorities.get(model_name.lower(), 0)
+
+    @property
+    def has_free_slot(self) -> bool:
+        if self.max_captures is None:
+            return True
+        return len(self.active) + len(self.starting) < self.max_captures
+
+    def is_pending(self, loader: StreamLoader) -> bool:
+        key = loader.model_name.lower()
+        return key in self.pending or key in self.starting
+
+    def get_pending_url(self, loader: StreamLoader) -> Optional[URL]:
+        entry = self.pending.get(loader.model_name.lower())
+        return entry[1] if entry is not None else None
+
+    def request(
+        self,
+        loader: StreamLoader,
+        playlist_url: Union[str, URL],
+        requested_at: Optional[float] = None,
+    ) -> str:
+        key = loader.model_name.lower()
+        if key in self.active or key in self.starting:
+            return "active"
+        if self.has_free_slot:
+            self.start(loader, URL(playlist_url), requested_at)
+            return "admitted"
+        if self.preempt:
+            victim = self.find_victim(self.priority(key))
+            if victim is not None:
+                self.metrics["preempted"] += 1
+                logger.info(
+                    f"governor: {loader.model_name} preempts {victim.model_name}"
+                )
+                url = victim.playlist_url
+                self.stop(victim)
+                self.enqueue(victim, url)
+                self.start(loader, URL(playlist_url), requested_at)
+                return "preempted"
+        self.enqueue(loader, URL(playlist_url), requested_at)
+        return "queued"
+
+    def find_victim(self, priority: int) -> Optional[StreamLoader]:
+        victim = None
+        for loader, _ in self.active.values():
+            loader_priority = self.priority(loader.model_name)
+            if loader_priority >= priority:
+                continue
+            if victim is None or loader_priority < self.priority(victim.model_name):
+                victim = loader
+        return victim
+
+    def enqueue(
+        self,
+        loader: StreamLoader,
+        playlist_url: URL,
+        requested_at: Optional[float] = None,
+    ):
+        key = loader.model_name.lower()
+        if key not in self.pending:
+            heapq.heappush(
+                self.queue, (-self.priority(key), next(self._counter), key)
+            )
+            self.metrics["queued"] += 1
+            logger.info(
+                f"governor: {loader.model_name} queued, "
+                f"{len(self.active)}/{self.max_captures} captures running"
+            )
+        self.pending[key] = (loader, playlist_url, requested_at)
+
+    def start(
+        self,
+        loader: StreamLoader,
+        playlist_url: URL,
+        requested_at: Optional[float] = None,
+    ):
+        if self.admission is None:
+            self.start_capture(loader, playlist_url, requested_at)
+            return
+        key = loader.model_name.lower()
+        self.starting[key] = asyncio.ensure_future(
+            self.admit(loader, playlist_url, requested_at)
+        )
+
+    async def admit(
+        self,
+        loader: StreamLoader,
+        playlist_url: URL,
+        requested_at: Optional[float] = None,
+    ):
+        key = loader.model_name.lower()
+        try:
+            admitted = await self.admission(loader, playlist_url, requested_at)
+        except asyncio.CancelledError:
+            # stopped while waiting, undo whatever the check acquired
+            if self.on_stopped is not None:
+                self.on_stopped(loader)
+            raise
+        except Exception:
+            logger.exception(f"governor: admission of {loader.model_name} failed")
+            admitted = False
+        del self.starting[key]
+        if admitted:
+            self.start_capture(loader, playlist_url, requested_at)
+        else:
+            self.metrics["refused"] += 1
+            self.admit_pending()
+
+    def start_capture(
+        self,
+        loader: StreamLoader,
+        playlist_url: URL,
+        requested_at: Optional[float] = None,
+    ):
+        loader.start_capture(playlist_url, requested_at=requested_at)
+        task = loader.capture_task
+        key = loader.model_name.lower()
+        self.active[key] = (loader, task)
+        task.add_done_callback(lambda t: self.release(key, t))
+        self.metrics["admitted"] += 1
+
+    def stop(self, loader: StreamLoader):
+        key = loader.model_name.lower()
+        starting = self.starting.pop(key, None)
+        if starting is not None:
+            starting.cancel()
+        if self.active.pop(key, None) is not None and self.on_stopped is not None:
+            self.on_stopped(loader)
+        loader.stop_capture()
+
+    def stop_all(self) -> List[asyncio.Task]:
+        # shutdown: nothing queued may start, returns the stopped captures
+        self.pending.clear()
+        self.queue.clear()
+        tasks = [task for _, task in self.active.values()]
+        for loader, _ in list(self.active.values()):
+            self.stop(loader)
+        for task in list(self.starting.values()):
+            task.cancel()
+        self.starting.clear()
+        return tasks
+
+    def cancel(self, loader: StreamLoader):
+        key = loader.model_name.lower()
+        if self.pending.pop(key, None) is not None:
+            self.queue = [entry for entry in self.queue if entry[2] != key]
+            heapq.heapify(self.queue)
+            self.metrics["cancelled"] += 1
+        self.stop(loader)
+        self.admit_pending()
+
+    def release(self, key: str, task: asyncio.Task):
+        entry = self.active.get(key)
+        if entry is not None and entry[1] is task:
+            del self.active[key]
+            self.metrics["released"] += 1
+            if self.on_finished is not None:
+                self.on_finished(entry[0])
+        self.admit_pending()
+
+    def admit_pending(self):
+        while self.queue and self.has_free_slot:
+            _, _, key = heapq.heappop(self.queue)
+            loader, playlist_url, requested_at = self.pending.pop(key)
+            logger.info(f"governor: {loader.model_name} admitted from queue")
+            self.start(loader, playlist_url, requested_at)
+
+    async def throttle(self, nbytes: int):
+        rate = self.max_bytes_per_second
+        if not rate:
+            return
+        now = monotonic()
+        self._allowance = min(rate, self._allowance + (now - self._last_refill) * rate)
+        self._last_refill = now
+        self._allowance -= nbytes
+        if self._allowance < 0:
+            self.metrics["throttled"] += 1
+            await asyncio.sleep(-self._allowance / rate)
+
+    @property
+    def status(self) -> str:
+        limit = self.max_captures if self.max_captures is not None else "-"
+        counters = " ".join(f"{k}={v}" for k, v in sorted(self.metrics.items()))
+        return (
+            f"governor: active {len(self.active)}/{limit}, "
+            f"queued {len(self.pending)} {counters}"
+        )
@@ -0,0 +1,113 @@
+import logging
+import math
+from typing import Dict, Optional
+from aiohttp import web
+from .diagnostics import Diagnostics
+from .streamloader import StreamLoader
+
+logger = logging.getLogger(__name__)
+
+
+class HlsServer(object):
+    """Re-serves buffered segments of active captures as live HLS.
+
+    Segments come from each StreamLoader's in-memory ring buffer, so local
+    players and tools never cause another fetch from the MFC edge.
+    """
+
+    streams: Dict[str, StreamLoader]
+    host: str
+    port: int
+    diagnostics: Optional[Diagnostics]
+    runner: Optional[web.AppRunner]
+
+    def __init__(
+        self,
+        streams: Dict[str, StreamLoader],
+        host: str = "127.0.0.1",
+        port: int = 8080,
+        diagnostics: Optional[Diagnostics] = None,
+    ):
+        self.streams = streams
+        self.host = host
+        self.port = port
+        self.diagnostics = diagnostics
+        self.runner = None
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/", self.index)
+        app.router.add_get("/{model}/live.m3u8", self.playlist)
+        app.router.add_get(r"/{model}/{sequence:\d+}.ts", self.segment)
+        if self.diagnostics is not None:
+            app.router.add_post("/debug/profile", self.profile)
+            app.router.add_post("/debug/tracemalloc", self.tracemalloc)
+        return app
+
+    async def start(self):
+        self.runner = web.AppRunner(self.make_app())
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+        logger.info(f"HLS server listening on http://{self.host}:{self.port}/")
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    def get_loader(self, request: web.Request) -> StreamLoader:
+        model = request.match_info["model"].lower()
+        for model_name, loader in self.streams.items():
+            if model_name.lower() == model and loader.segment_buffer:
+                return loader
+        raise web.HTTPNotFound()
+
+    async def index(self, request: web.Request) -> web.Response:
+        models = sorted(
+            model_name
+            for model_name, loader in self.streams.items()
+            if loader.segment_buffer and loader.in_progress
+        )
+        return web.json_response(
+            {model: f"/{model}/live.m3u8" for model in models}
+        )
+
+    async def playlist(self, request: web.Request) -> web.Response:
+        loader = self.get_loader(request)
+        segments = list(loader.segment_buffer)
+        target_duration = math.ceil(max(s.duration for s in segments)) or 1
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:3",
+            f"#EXT-X-TARGETDURATION:{target_duration}",
+            f"#EXT-X-MEDIA-SEQUENCE:{segments[0].sequence}",
+            f"#EXT-X-DISCONTINUITY-SEQUENCE:{loader.buffer_discontinuities}",
+        ]
+        for segment in segments:
+            if segment.discontinuity:
+                lines.append("#EXT-X-DISCONTINUITY")
+            lines.append(f"#EXTINF:{segment.duration:.3f},")
+            lines.append(f"{segment.sequence}.ts")
+        if not loader.in_progress:
+            lines.append("#EXT-X-ENDLIST")
+        return web.Response(
+            text="\n".join(lines) + "\n",
+            content_type="application/vnd.apple.mpegurl",
+            headers={"Cache-Control": "no-cache"},
+        )
+
+    async def segment(self, request: web.Request) -> web.Response:
+        loader = self.get_loader(request)
+        buffer = loader.segment_buffer
+        index = int(request.match_info["sequence"]) - buffer[0].sequence
+        if not 0 <= index < len(buffer):
+            raise web.HTTPNotFound()
+        return web.Response(body=buffer[index].data, content_type="video/mp2t")
+
+    async def profile(self, request: web.Request) -> web.Response:
+        path = self.diagnostics.toggle_profile()
+        return web.json_response({"profiling": path is None, "dump": str(path or "")})
+
+    async def tracemalloc(self, request: web.Request) -> web.Response:
+        path = self.diagnostics.snapshot_memory()
+        return web.json_response({"tracing": True, "dump": str(path or "")})
@@ -0,0 +1,120 @@
+import logging
+import queue
+import sys
+import threading
+from logging.handlers import QueueHandler, QueueListener
+from time import monotonic
+from typing import Dict, List, Optional, TextIO, Tuple
+
+LOG_FORMAT = "%(levelname)s:%(name)s:%(message)s"
+
+
+class DeferredQueueHandler(QueueHandler):
+    # QueueHandler.prepare() formats the record on the calling thread;
+    # records stay in this process, so hand them over untouched and let
+    # the listener thread do the formatting.
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class RateLimitFilter(logging.Filter):
+    """Let one copy of a repeated warning through per ``interval`` seconds.
+
+    Records are considered repeats when logger, level, message template
+    and first argument are equal. Per-model messages in this package pass
+    the model name as the first argument of a %-style template, so this
+    means the same problem on the same model. The next copy let through
+    carries the number of suppressed repeats.
+    """
+
+    interval: float
+    level: int
+    seen: Dict[Tuple[str, int, str, tuple], Tuple[float, int, tuple]]
+    lock: threading.Lock
+
+    def __init__(self, interval: float = 30.0, level: int = logging.WARNING):
+        super().__init__()
+        self.interval = interval
+        self.level = level
+        self.seen = {}
+        # records are filtered on whichever thread logs them
+        self.lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < self.level:
+            return True
+        args = record.args if isinstance(record.args, tuple) else ()
+        key = (record.name, record.levelno, str(record.msg), args[:1])
+        now = monotonic()
+        with self.lock:
+            entry = self.seen.get(key)
+            if entry is not None and now - entry[0] < self.interval:
+                self.seen[key] = (entry[0], entry[1] + 1, args)
+                return False
+            self.seen[key] = (now, 0, args)
+            if len(self.seen) > 1024:
+                self.prune(now)
+        if entry is not None and entry[1]:
+            record.msg = f"{record.msg} [{entry[1]} repeats suppressed]"
+        return True
+
+    def prune(self, now: float):
+        self.seen = {
+            key: entry
+            for key, entry in self.seen.items()
+            if now - entry[0] < self.interval or entry[1]
+        }
+
+    def flush(self) -> List[Tuple[str, int, str, int]]:
+        # (logger, level, last suppressed message, count) of pending repeats
+        with self.lock:
+            seen, self.seen = self.seen, {}
+        suppressed = []
+        for (name, levelno, msg, _), (_, count, args) in seen.items():
+            if count:
+                record = logging.LogRecord(name, levelno, "", 0, msg, args, None)
+                suppressed.append((name, levelno, record.getMessage(), count))
+        return suppressed
+
+
+_listener: Optional[QueueListener] = None
+_filter: Optional[RateLimitFilter] = None
+_handler: Optional[QueueHandler] = None
+
+
+def setup_logging(
+    level: int = logging.INFO,
+    rate_limit: Optional[float] = 30.0,
+    stream: Optional[TextIO] = None,
+):
+    global _listener, _filter, _handler
+    stop_logging()
+    stream_handler = logging.StreamHandler(stream or sys.stderr)
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    if rate_limit:
+        _filter = RateLimitFilter(rate_limit)
+        queue_handler.addFilter(_filter)
+    root = logging.getLogger()
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    _handler = queue_handler
+    _listener = QueueListener(log_queue, stream_handler)
+    _listener.start()
+
+
+def stop_logging():
+    global _listener, _filter, _handler
+    if _listener is None:
+        return
+    if _filter is not None:
+        for name, levelno, msg, count in _filter.flush():
+            logging.getLogger(name).log(
+                levelno, "%s [%d repeats suppressed]", msg, count
+            )
+        _filter = None
+    _listener.stop()
+    _listener = None
+    logging.getLogger().removeHandler(_handler)
+    _handler = None
@@ -1,14 +1,23 @@
 import asyncio
 import logging
 import re
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from random import choice, random
 from time import time
-from typing import List, Dict, Any, Optional, cast
+from typing import Iterable, List, Dict, Any, Optional, Union, cast
 from aiohttp import ClientSession, ClientResponse
 from yarl import URL
 from .mfcwschat import MfcWsChat, Message
 from .mfccrc import MfcCrc32
+from .chatrecorder import ChatReplay
 from .streamloader import StreamLoader
+from .governor import CaptureGovernor
+from .coordination import LeaseCoordinator
+from .logsetup import setup_logging, stop_logging
+from .diagnostics import Diagnostics, timed
+from .storage import StorageManager
+from . import backends
 
 # import fcs
 
@@ -25,7 +34,6 @@ MODEL_STATUS = {
     127: "offline",
 }
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
@@ -45,25 +53,76 @@ class MfcGrabber(object):
     session: ClientSession
     server_config: Dict[str, Any]
     models: List[str]
-    chat: MfcWsChat
+    chat: Union[MfcWsChat, ChatReplay]
     streams: Dict[str, StreamLoader]
+    # seconds a loader may sit idle before it is dropped, None keeps them
+    loader_idle_ttl: Optional[float]
+    governor: CaptureGovernor
+    executor: ThreadPoolExecutor
+    coordinator: Optional[LeaseCoordinator]
+    diagnostics: Optional[Diagnostics]
+    storage: StorageManager
+    start_policy: Union[str, float]
+    fetch_backlog: bool
+    # segments kept in memory per stream for the local HLS server
+    buffer_segments: int
     progress_log_task: Optional[asyncio.Task]
 
-    def __init__(self, session: ClientSession, models=[]):
+    def __init__(
+        self,
+        session: ClientSession,
+        models=[],
+        chat: Optional[Union[MfcWsChat, ChatReplay]] = None,
+        governor: Optional[CaptureGovernor] = None,
+        coordinator: Optional[LeaseCoordinator] = None,
+        diagnostics: Optional[Diagnostics] = None,
+        storage: Optional[StorageManager] = None,
+    ):
         self.session = session
-        self.chat = MfcWsChat(session)
+        self.diagnostics = diagnostics
+        self.storage = storage if storage is not None else StorageManager()
+        self.governor = governor if governor is not None else CaptureGovernor()
+        self.governor.on_finished = self.capture_finished
+        self.governor.admission = self.admit_capture
+        self.governor.on_stopped = self.release_lease
+        self.coordinator = coordinator
+        if coordinator is not None:
+            coordinator.on_lost = self.lease_lost
+        # segment verification pool, keeps TS parsing off the event loop
+        self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="verify")
+        self.start_policy = "full"
+        self.fetch_backlog = False
+        self.buffer_segments = 0
+        self.chat = chat if chat is not None else MfcWsChat(session)
         self.server_config = dict(
             ajax_servers=[],
         )
         self.models = [m.lower() for m in models]
         self.streams = {}
+        self.loader_idle_ttl = 600
         self.progress_log_task = None
 
     @classmethod
-    async def create(cls, models: List[str] = []):
+    async def create(
+        cls,
+        models: List[str] = [],
+        chat: Optional[Union[MfcWsChat, ChatReplay]] = None,
+        governor: Optional[CaptureGovernor] = None,
+        coordinator: Optional[LeaseCoordinator] = None,
+        diagnostics: Optional[Diagnostics] = None,
+        storage: Optional[StorageManager] = None,
+    ):
         headers = {"Referrer": REFERRER, "User-Agent": USER_AGENT}
         session = ClientSession(headers=headers, raise_for_status=True)
-        return cls(session, models=models)
+        return cls(
+            session,
+            models=models,
+            chat=chat,
+            governor=governor,
+            coordinator=coordinator,
+            diagnostics=diagnostics,
+            storage=storage,
+        )
 
     async def progress_log(self):
         try:
@@ -73,18 +132,36 @@ class MfcGrabber(object):
                     stream_loader = self.streams[mn]
                     if stream_loader.in_progress:
                         logger.info(f'{mn} -> {stream_loader.status}')
+                if self.governor.max_captures or self.governor.metrics:
+                    logger.info(self.governor.status)
+                self.evict_idle_loaders()
                 await asyncio.sleep(6)
         except asyncio.CancelledError:
             pass
 
     async def grab(self):
+        if self.diagnostics is not None:
+            self.diagnostics.start()
+        self.storage.start()
         await self.get_server_config()
         logger.info("Server config loaded")
         ws_server = self.get_ws_server()
         await self.chat.connect(ws_server)
         await self.lookup_modes()
+        if self.coordinator is not None:
+            self.coordinator.start()
         self.progress_log_task = asyncio.create_task(self.progress_log())
+        await self.dispatch()
+
+    async def replay(self):
+        # offline run against a ChatReplay: no server config, no lookups
+        if self.diagnostics is not None:
+            self.diagnostics.start()
+        self.storage.start()
+        await self.chat.connect(None)
+        await self.dispatch()
 
+    async def dispatch(self):
         message: Message
         async for message in self.chat:
             if not message:
@@ -96,11 +173,36 @@ class MfcGrabber(object):
                     if nm.lower() in self.models:
                         await self.handle_model(message)
 
+    def configure_loaders(
+        self,
+        start_policy: Union[str, float],
+        fetch_backlog: bool,
+        buffer_segments: int = 0,
+    ):
+        self.start_policy = start_policy
+        self.fetch_backlog = fetch_backlog
+        self.buffer_segments = buffer_segments
+        for stream_loader in self.streams.values():
+            stream_loader.start_policy = start_policy
+            stream_loader.fetch_backlog = fetch_backlog
+            stream_loader.set_buffer_size(buffer_segments)
+
+    @timed("MfcGrabber.handle_model")
     async def handle_model(self, message: Message):
+        received_at = time()
         message.payload = cast(dict, message.payload)
         model_name = message.payload["nm"]
         if model_name not in self.streams:
-            stream_loader = StreamLoader(self.session, model_name)
+            stream_loader = StreamLoader(
+                self.session,
+                model_name,
+                throttle=self.governor.throttle,
+                executor=self.executor,
+                start_policy=self.start_policy,
+                fetch_backlog=self.fetch_backlog,
+                storage=self.storage,
+                buffer_segments=self.buffer_segments,
+            )
             self.streams[model_name] = stream_loader
 
         stream_loader = self.streams[model_name]
@@ -108,10 +210,8 @@ class MfcGrabber(object):
         video_status = message.payload["vs"]
         # 0 == model in public chat
         if video_status == 0:
-            if stream_loader.in_progress:
-                logger.debug('{} already in progress'.format(
-                    model_name
-                ))
+            if self.is_handled(stream_loader):
+                logger.debug("%s already in progress", model_name)
                 return
             logger.info(f"{model_name} status is {MODEL_STATUS[video_status]}")
             try:
@@ -123,15 +223,104 @@ class MfcGrabber(object):
                 return
             model_uid = message.payload["uid"]
             hls_url = self.build_hls_url(camserv, model_uid)
-            if hls_url is not None:
-                stream_loader.start_capture(hls_url)
-            else:
+            if hls_url is None:
                 logger.info(f"Cannot get sream URL for {model_name}")
+                return
+            self.request_capture(stream_loader, hls_url, received_at)
         else:
 
             m_status = MODEL_STATUS.get(video_status, video_status)
             logger.info(f"{model_name} status is {m_status}")
-            stream_loader.stop_capture()
+            self.governor.cancel(stream_loader)
+            if self.coordinator is not None:
+                await self.coordinator.release(model_name.lower())
+
+    def evict_idle_loaders(self, now: Optional[float] = None) -> int:
+        if self.loader_idle_ttl is None:
+            return 0
+        now = now if now is not None else time()
+        evicted = 0
+        for model_name, stream_loader in list(self.streams.items()):
+            if self.is_handled(stream_loader):
+                continue
+            if now - stream_loader.idle_since >= self.loader_idle_ttl:
+                del self.streams[model_name]
+                evicted += 1
+        if evicted:
+            logger.debug("Evicted %d idle stream loaders", evicted)
+        return evicted
+
+    def is_handled(self, stream_loader: StreamLoader) -> bool:
+        if stream_loader.in_progress or self.governor.is_pending(stream_loader):
+            return True
+        if self.coordinator is not None:
+            return stream_loader.model_name.lower() in self.coordinator.waiting
+        return False
+
+    def request_capture(
+        self,
+        stream_loader: StreamLoader,
+        hls_url: URL,
+        requested_at: Optional[float] = None,
+    ):
+        decision = self.governor.request(
+            stream_loader, hls_url, requested_at=requested_at
+        )
+        logger.debug("%s: capture %s", stream_loader.model_name, decision)
+        if decision == "queued":
+            # a lease taken over from another host is not kept while queued
+            self.release_lease(stream_loader)
+
+    async def admit_capture(
+        self,
+        stream_loader: StreamLoader,
+        hls_url: URL,
+        requested_at: Optional[float] = None,
+    ) -> bool:
+        model_name = stream_loader.model_name
+        if not self.storage.accepting_captures:
+            logger.warning(
+                f"{model_name}: not captured, low disk space in "
+                f"{self.storage.work_dir}"
+            )
+            return False
+        if self.coordinator is None:
+            return True
+        model_key = model_name.lower()
+        if await self.coordinator.acquire(model_key):
+            return True
+        logger.info(f"{model_name} is captured by another host")
+        start = partial(self.request_capture, stream_loader, hls_url, requested_at)
+        self.coordinator.wait_for(model_key, start)
+        return False
+
+    def release_lease(self, stream_loader: StreamLoader):
+        if self.coordinator is None:
+            return
+        model_key = stream_loader.model_name.lower()
+        if model_key in self.coordinator.held:
+            asyncio.ensure_future(self.coordinator.release(model_key))
+
+    def capture_finished(self, stream_loader: StreamLoader):
+        if self.coordinator is None or stream_loader.playlist_url is None:
+            return
+        if stream_loader.storage_full:
+            # restarting here would fail the same way, let other hosts have it
+            self.release_lease(stream_loader)
+            return
+        start = partial(self.request_capture, stream_loader, stream_loader.playlist_url)
+        self.coordinator.handover(stream_loader.model_name.lower(), start)
+
+    def lease_lost(self, model_key: str):
+        for model_name, stream_loader in self.streams.items():
+            if model_name.lower() != model_key:
+                continue
+            hls_url = self.governor.get_pending_url(stream_loader)
+            hls_url = hls_url or stream_loader.playlist_url
+            self.governor.cancel(stream_loader)
+            if hls_url is not None:
+                start = partial(self.request_capture, stream_loader, hls_url)
+                self.coordinator.wait_for(model_key, start)
 
     def get_video_server(self, camserv: int):
         camserv = str(camserv)
@@ -142,7 +331,7 @@ class MfcGrabber(object):
         ]
         server_type: str
         for server_type in server_types:
-            v_servers = self.server_config[server_type]
+            v_servers = self.server_config.get(server_type, {})
             if camserv in v_servers:
                 return v_servers[camserv]
 
@@ -189,8 +378,27 @@ class MfcGrabber(object):
         async with self.session.get(url) as resp:
             return await resp.text()
 
+    async def add_models(self, models: Iterable[str]):
+        new_models = [m.lower() for m in models if m.lower() not in self.models]
+        self.models.extend(new_models)
+        if self.chat.connected:
+            await self.lookup_models(new_models)
+
+    def remove_models(self, models: Iterable[str]):
+        removed = {m.lower() for m in models}
+        self.models = [m for m in self.models if m not in removed]
+        for model_name in list(self.streams):
+            if model_name.lower() in removed:
+                self.governor.cancel(self.streams.pop(model_name))
+        if self.coordinator is not None:
+            for model in removed:
+                asyncio.ensure_future(self.coordinator.release(model))
+
     async def lookup_modes(self):
-        for model in self.models:
+        await self.lookup_models(self.models)
+
+    async def lookup_models(self, models: Iterable[str]):
+        for model in models:
             query_type = 10
             query_sign = self.get_lookup_query_sign(model)
             query_string = "{} {} 0 {} 0 {}\n".format(
@@ -204,7 +412,22 @@ class MfcGrabber(object):
         s = f"{model_name}{now}{{}}"
         return abs(MfcCrc32.string(s))
 
+    async def stop_captures(self):
+        tasks = self.governor.stop_all()
+        for stream_loader in self.streams.values():
+            if stream_loader.in_progress:
+                tasks.append(stream_loader.capture_task)
+                stream_loader.stop_capture()
+        if tasks:
+            logger.info(f"Stopping {len(tasks)} captures")
+            await asyncio.wait(tasks)
+
     async def stop(self):
+        if self.diagnostics is not None:
+            await self.diagnostics.stop()
+        await self.stop_captures()
+        if self.coordinator is not None:
+            await self.coordinator.stop()
         if self.session and not self.session.closed:
             if self.chat.connected:
                 logger.info("Stop chat")
@@ -214,10 +437,14 @@ class MfcGrabber(object):
             if not self.progress_log_task.done():
                 self.progress_log_task.cancel()
                 await self.progress_log_task
+        await self.storage.stop()
+        self.executor.shutdown(wait=False)
 
 
 def main():
-    loop = asyncio.get_event_loop()
+    setup_logging()
+    loop = backends.new_event_loop()
+    asyncio.set_event_loop(loop)
     grabber = loop.run_until_complete(
         MfcGrabber.create(
             models=[
@@ -237,6 +464,8 @@ def main():
         loop.run_until_complete(grabber.grab())
     except KeyboardInterrupt:
         loop.run_until_complete(grabber.stop())
+    finally:
+        stop_logging()
 
 
 if __name__ == "__main__":
@@ -1,25 +1,55 @@
 import asyncio
 import logging
-import json
 from collections import deque
-from dataclasses import dataclass
-from typing import List, Optional, Deque, Union, cast
+from typing import TYPE_CHECKING, List, Optional, Deque, Union, cast
 from random import choice, randint
 from urllib.parse import unquote
 from aiohttp import ClientSession, ClientWebSocketResponse, WSMsgType
 from yarl import URL
+from .diagnostics import timed
+from . import backends
+
+if TYPE_CHECKING:
+    from .chatrecorder import ChatRecorder
 
 logger = logging.getLogger(__name__)
 
 
-@dataclass(init=True, repr=True)
-class Message:
+class Message(object):
+    # one instance per chat message, so no per-instance __dict__
+    __slots__ = ("n_type", "n_from", "n_to", "n_arg1", "n_arg2", "payload")
+
     n_type: int
     n_from: int
     n_to: int
     n_arg1: int
     n_arg2: int
-    payload: Optional[Union[str, dict]] = None
+    payload: Optional[Union[str, dict]]
+
+    def __init__(
+        self,
+        n_type: int,
+        n_from: int,
+        n_to: int,
+        n_arg1: int,
+        n_arg2: int,
+        payload: Optional[Union[str, dict]] = None,
+    ):
+        self.n_type = n_type
+        self.n_from = n_from
+        self.n_to = n_to
+        self.n_arg1 = n_arg1
+        self.n_arg2 = n_arg2
+        self.payload = payload
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"Message({fields})"
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Message):
+            return NotImplemented
+        return all(getattr(self, n) == getattr(other, n) for n in self.__slots__)
 
     @classmethod
     def from_text(cls, text: str):
@@ -29,9 +59,9 @@ class Message:
         if len(args) == 6:
             payload = args.pop()
             try:
-                payload = json.loads(payload)
-            except json.JSONDecodeError:
-                logger.debug("Cannot parse payload, raw text is: ", payload)
+                payload = backends.json_loads(payload)
+            except backends.JSONDecodeError:
+                logger.debug("Cannot parse payload, raw text is: %s", payload)
         n_type, n_from, n_to, n_arg1, n_arg2 = [int(arg) for arg in args]
         return cls(n_type, n_from, n_to, n_arg1, n_arg2, payload=payload)
 
@@ -42,10 +72,14 @@ class MfcWsChat(object):
     ping_task: Optional[asyncio.Task]
     user_session_id: int
     user_session_name: Optional[str]
-    messages_buffer: Deque[str]
+    messages_buffer: Deque[Message]
+    recorder: Optional["ChatRecorder"]
 
-    def __init__(self, session: ClientSession):
+    def __init__(
+        self, session: ClientSession, recorder: Optional["ChatRecorder"] = None
+    ):
         self.session = session
+        self.recorder = recorder
         self.ws = None
         self.ping_task = None
         self.user_session_id = 0
@@ -97,9 +131,19 @@ class MfcWsChat(object):
             await self.ping_task
         logger.info("Ping stopped")
 
+    @staticmethod
+    def parse_frame(data: str) -> List[Message]:
+        messages = []
+        while data:
+            m_len = int(data[:6])
+            messages.append(Message.from_text(data[6 : m_len + 6]))
+            data = data[m_len + 6 :]
+        return messages
+
     def __aiter__(self):
         return self
 
+    @timed("MfcWsChat.__anext__")
     async def __anext__(self):
         if not self.connected:
             raise StopAsyncIteration
@@ -107,11 +151,8 @@ class MfcWsChat(object):
             return self.messages_buffer.popleft()
         msg = await self.ws.receive()
         if msg.type == WSMsgType.TEXT:
-            data = msg.data
-            while data:
-                m_len = int(data[:6])
-                message = Message.from_text(data[6 : m_len + 6])
-                self.messages_buffer.append(message)
-                data = data[m_len + 6 :]
+            if self.recorder is not None:
+                self.recorder.record(msg.data)
+            self.messages_buffer.extend(self.parse_frame(msg.data))
             if self.messages_buffer:
                 return self.messages_buffer.popleft()
@@ -0,0 +1,124 @@
+import struct
+from bisect import bisect_right
+from pathlib import Path
+from typing import BinaryIO, Iterable, List, NamedTuple, Optional, Union
+
+# Sidecar layout: MAGIC, then fixed-size little-endian records
+#   <uint8 kind><uint64 sequence><float64 unix time><float32 duration>
+#   <uint64 byte offset><uint32 size>
+# kind 1 is a segment, kind 2 a keyframe inside the preceding segment
+# (time, duration and size are zero for keyframes).
+MAGIC = b"MFCIDX1\n"
+RECORD = struct.Struct("<BQdfQI")
+SEGMENT = 1
+KEYFRAME = 2
+
+
+class IndexFormatError(Exception):
+    pass
+
+
+class SegmentEntry(NamedTuple):
+    sequence: int
+    timestamp: float
+    duration: float
+    offset: int
+    size: int
+
+
+def get_index_filename(filename: Union[str, Path]) -> str:
+    return f"{filename}.idx"
+
+
+class SeekIndexWriter(object):
+    path: Path
+    fd: Optional[BinaryIO]
+    # readers bisect on sequences, they must keep increasing within a file
+    last_sequence: Optional[int]
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.fd = None
+        self.last_sequence = None
+
+    def accepts(self, sequence: int) -> bool:
+        return self.last_sequence is None or sequence > self.last_sequence
+
+    def add_segment(
+        self,
+        sequence: int,
+        timestamp: float,
+        duration: float,
+        offset: int,
+        size: int,
+        keyframes: Iterable[int] = (),
+    ):
+        if self.fd is None:
+            self.fd = open(self.path, "ab")
+            if self.fd.tell() == 0:
+                self.fd.write(MAGIC)
+        records = [RECORD.pack(SEGMENT, sequence, timestamp, duration, offset, size)]
+        for keyframe in keyframes:
+            records.append(RECORD.pack(KEYFRAME, sequence, 0, 0, offset + keyframe, 0))
+        self.fd.write(b"".join(records))
+        self.fd.flush()
+        self.last_sequence = sequence
+
+    def close(self):
+        if self.fd is not None:
+            self.fd.close()
+            self.fd = None
+
+
+class SeekIndex(object):
+    segments: List[SegmentEntry]
+    keyframes: List[int]
+
+    def __init__(self, segments: List[SegmentEntry], keyframes: List[int]):
+        self.segments = segments
+        self.keyframes = keyframes
+        self._times = [s.timestamp for s in segments]
+        self._sequences = [s.sequence for s in segments]
+        self._offsets = [s.offset for s in segments]
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> "SeekIndex":
+        with open(path, "rb") as fd:
+            data = fd.read()
+        if not data.startswith(MAGIC):
+            raise IndexFormatError(f"{path} is not a seek index")
+        # a record cut short by a crash is ignored
+        end = len(MAGIC) + (len(data) - len(MAGIC)) // RECORD.size * RECORD.size
+        segments = []
+        keyframes = []
+        for kind, sequence, timestamp, duration, offset, size in RECORD.iter_unpack(
+            data[len(MAGIC) : end]
+        ):
+            if kind == SEGMENT:
+                segments.append(
+                    SegmentEntry(sequence, timestamp, duration, offset, size)
+                )
+            elif kind == KEYFRAME:
+                keyframes.append(offset)
+        return cls(segments, keyframes)
+
+    def __len__(self) -> int:
+        return len(self.segments)
+
+    def _entry(self, keys: List, key) -> Optional[SegmentEntry]:
+        index = bisect_right(keys, key) - 1
+        return self.segments[index] if index >= 0 else None
+
+    def find_time(self, timestamp: float) -> Optional[SegmentEntry]:
+        return self._entry(self._times, timestamp)
+
+    def find_sequence(self, sequence: int) -> Optional[SegmentEntry]:
+        entry = self._entry(self._sequences, sequence)
+        return entry if entry is not None and entry.sequence == sequence else None
+
+    def find_offset(self, offset: int) -> Optional[SegmentEntry]:
+        return self._entry(self._offsets, offset)
+
+    def keyframe_before(self, offset: int) -> Optional[int]:
+        index = bisect_right(self.keyframes, offset) - 1
+        return self.keyframes[index] if index >= 0 else None
@@ -0,0 +1,53 @@
+from collections import OrderedDict
+from typing import Tuple
+
+Fingerprint = Tuple[int, int]
+
+
+def get_chunk_name(uri: str) -> str:
+    # the query string carries a cache buster that changes between chunklists
+    return uri.split("?", 1)[0]
+
+
+class SegmentCache(object):
+    """Bounded memory of recently captured segments.
+
+    Segments are remembered by chunk name, which is checked before a
+    download, and by (size, crc32) fingerprint, which catches the same
+    content served again under a different name after an edge restart.
+    """
+
+    maxlen: int
+    names: "OrderedDict[str, None]"
+    fingerprints: "OrderedDict[Fingerprint, None]"
+
+    def __init__(self, maxlen: int = 64):
+        self.maxlen = maxlen
+        self.names = OrderedDict()
+        self.fingerprints = OrderedDict()
+
+    def _add(self, entries: OrderedDict, key):
+        entries[key] = None
+        entries.move_to_end(key)
+        if len(entries) > self.maxlen:
+            entries.popitem(last=False)
+
+    def seen_name(self, uri: str) -> bool:
+        return get_chunk_name(uri) in self.names
+
+    def add_name(self, uri: str):
+        self._add(self.names, get_chunk_name(uri))
+
+    def seen_fingerprint(self, fingerprint: Fingerprint) -> bool:
+        return fingerprint in self.fingerprints
+
+    def add_fingerprint(self, fingerprint: Fingerprint):
+        self._add(self.fingerprints, fingerprint)
+
+    def forget_names(self):
+        # after an edge restart names are reused for new content
+        self.names.clear()
+
+    def clear(self):
+        self.names.clear()
+        self.fingerprints.clear()
@@ -0,0 +1,281 @@
+import asyncio
+import ctypes
+import ctypes.util
+import logging
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from time import monotonic, time
+from typing import Callable, List, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+COPY_BUFFER_SIZE = 1024 * 1024
+# files untouched this long are not written by anyone anymore
+FINISHED_FILE_AGE = 60
+
+
+# fallocate(2) mode that reserves blocks without changing the file size
+FALLOC_FL_KEEP_SIZE = 0x01
+
+
+def _load_fallocate() -> Optional[Callable[[int, int, int, int], int]]:
+    # posix_fallocate grows the visible size and glibc emulates it by
+    # writing every block where the filesystem has no fallocate
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        func = libc.fallocate64
+    except (OSError, AttributeError, TypeError):  # pragma: no cover - not Linux
+        return None
+    func.argtypes = (ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64)
+    func.restype = ctypes.c_int
+    return func
+
+
+_fallocate = _load_fallocate()
+
+
+def fallocate_keep_size(fd: int, offset: int, length: int):
+    if _fallocate(fd, FALLOC_FL_KEEP_SIZE, offset, length) != 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+
+
+class StorageFullError(Exception):
+    pass
+
+
+class OutputFile(object):
+    """Capture output written sequentially into preallocated extents.
+
+    With ``preallocate`` set, space is reserved ``preallocate`` bytes at a
+    time with fallocate(FALLOC_FL_KEEP_SIZE), which keeps long recordings
+    contiguous without growing the file, so a file left behind by a crash
+    holds no zero tail. Reserved blocks past the end are released on close.
+    """
+
+    path: Path
+    position: int
+    allocated: int
+    preallocate: int
+    duration: float
+
+    def __init__(self, path: Union[str, Path], preallocate: int = 0):
+        self.path = Path(path)
+        # appending to an existing file is allowed, but O_APPEND would
+        # write past the preallocated tail
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        self.fd = os.fdopen(fd, "r+b")
+        self.position = self.fd.seek(0, os.SEEK_END)
+        self.allocated = self.position
+        self.preallocate = preallocate if _fallocate is not None else 0
+        self.duration = 0.0
+
+    def reserve(self, size: int):
+        if not self.preallocate or self.position + size <= self.allocated:
+            return
+        length = max(self.preallocate, size)
+        try:
+            fallocate_keep_size(self.fd.fileno(), self.allocated, length)
+            self.allocated += length
+        except OSError as e:
+            logger.debug("Preallocation disabled for %s: %s", self.path, e)
+            self.preallocate = 0
+
+    def write(self, data: bytes, duration: float = 0) -> int:
+        offset = self.position
+        self.reserve(len(data))
+        self.fd.write(data)
+        self.fd.flush()
+        self.position += len(data)
+        self.duration += duration
+        return offset
+
+    def close(self):
+        if self.fd.closed:
+            return
+        if self.allocated > self.position:
+            self.fd.truncate(self.position)
+        self.fd.close()
+
+
+class StorageManager(object):
+    """Where captures are written and what happens to them afterwards.
+
+    Files are written to ``work_dir`` and rotated by size or duration.
+    Finished files are moved to ``archive_dir`` in the background, at most
+    ``move_bytes_per_second`` when the move needs a copy. Captures stop when
+    free space in ``work_dir`` drops under ``min_free_bytes``, and no new
+    ones start under ``reserve_free_bytes``.
+    """
+
+    work_dir: Path
+    archive_dir: Optional[Path]
+    max_file_size: Optional[int]
+    max_file_duration: Optional[float]
+    preallocate: int
+    min_free_bytes: int
+    reserve_free_bytes: int
+    move_bytes_per_second: Optional[float]
+    move_queue: Optional[asyncio.Queue]
+    mover_task: Optional[asyncio.Task]
+
+    def __init__(
+        self,
+        work_dir: Union[str, Path] = ".",
+        archive_dir: Optional[Union[str, Path]] = None,
+        max_file_size: Optional[int] = None,
+        max_file_duration: Optional[float] = None,
+        preallocate: int = 0,
+        min_free_bytes: int = 0,
+        reserve_free_bytes: int = 0,
+        move_bytes_per_second: Optional[float] = None,
+    ):
+        self.work_dir = Path(work_dir)
+        self.archive_dir = Path(archive_dir) if archive_dir else None
+        self.max_file_size = max_file_size
+        self.max_file_duration = max_file_duration
+        self.preallocate = preallocate
+        self.min_free_bytes = min_free_bytes
+        self.reserve_free_bytes = max(reserve_free_bytes, min_free_bytes)
+        self.move_bytes_per_second = move_bytes_per_second
+        self.move_queue = None
+        self.mover_task = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        # tells a copy running in the mover thread to give up
+        self._stopping = threading.Event()
+        self._free_bytes = 0
+        self._free_checked = 0.0
+
+    def get_path(self, filename: str) -> Path:
+        return self.work_dir / filename
+
+    def open_output(self, filename: str) -> OutputFile:
+        self.work_dir.mkdir(parents=True, exist_ok=True)
+        return OutputFile(self.get_path(filename), self.preallocate)
+
+    def should_rotate(self, output: OutputFile, size: int, duration: float) -> bool:
+        if not output.position:
+            return False
+        if self.max_file_size and output.position + size > self.max_file_size:
+            return True
+        max_duration = self.max_file_duration
+        return bool(max_duration and output.duration + duration > max_duration)
+
+    @property
+    def free_bytes(self) -> int:
+        # statvfs is cheap but not free; once a second is plenty
+        now = monotonic()
+        if now - self._free_checked >= 1:
+            self._free_checked = now
+            try:
+                self._free_bytes = shutil.disk_usage(self.work_dir).free
+            except OSError:
+                self._free_bytes = 0
+        return self._free_bytes
+
+    def check_space(self):
+        if self.min_free_bytes and self.free_bytes < self.min_free_bytes:
+            raise StorageFullError(
+                f"{self.work_dir}: only {self.free_bytes} bytes free, "
+                f"{self.min_free_bytes} required"
+            )
+
+    @property
+    def accepting_captures(self) -> bool:
+        if not self.reserve_free_bytes:
+            return True
+        return self.free_bytes >= self.reserve_free_bytes
+
+    def finish(self, *paths: Path):
+        if self.move_queue is None:
+            return
+        for path in paths:
+            if path.exists():
+                self.move_queue.put_nowait(path)
+
+    def start(self):
+        if self.archive_dir is None or self.mover_task is not None:
+            return
+        self.archive_dir.mkdir(parents=True, exist_ok=True)
+        self.move_queue = asyncio.Queue()
+        self._stopping.clear()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mover")
+        self.mover_task = asyncio.create_task(self.move_files())
+        for path in self.find_finished():
+            self.move_queue.put_nowait(path)
+
+    def find_finished(self) -> List[Path]:
+        # left behind by an earlier run that stopped before moving them
+        if not self.work_dir.is_dir():
+            return []
+        cutoff = time() - FINISHED_FILE_AGE
+        paths = []
+        for path in self.work_dir.iterdir():
+            if path.suffix not in (".mp4", ".idx") or not path.is_file():
+                continue
+            if path.stat().st_mtime < cutoff:
+                paths.append(path)
+        return sorted(paths)
+
+    async def stop(self):
+        self._stopping.set()
+        if self.mover_task is not None:
+            self.mover_task.cancel()
+            await self.mover_task
+            self.mover_task = None
+        self.move_queue = None
+        if self._executor is not None:
+            # an interrupted copy still has to remove its partial file
+            await asyncio.get_running_loop().run_in_executor(
+                None, self._executor.shutdown
+            )
+            self._executor = None
+
+    async def move_files(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                path = await self.move_queue.get()
+                try:
+                    target = await loop.run_in_executor(
+                        self._executor, self.move_file, path
+                    )
+                    logger.info(f"Moved {path} to {target}")
+                except OSError as e:
+                    logger.warning(f"Cannot move {path}: {e}")
+        except asyncio.CancelledError:
+            pass
+
+    def same_device(self, path: Path) -> bool:
+        return path.stat().st_dev == self.archive_dir.stat().st_dev
+
+    def move_file(self, path: Path) -> Path:
+        target = self.archive_dir / path.name
+        if self.same_device(path):
+            os.replace(path, target)
+            return target
+        partial = target.with_name(target.name + ".part")
+        rate = self.move_bytes_per_second
+        start = monotonic()
+        copied = 0
+        try:
+            with open(path, "rb") as src, open(partial, "wb") as dst:
+                while chunk := src.read(COPY_BUFFER_SIZE):
+                    if self._stopping.is_set():
+                        raise InterruptedError(f"{path}: copy interrupted")
+                    dst.write(chunk)
+                    copied += len(chunk)
+                    if rate:
+                        ahead = copied / rate - (monotonic() - start)
+                        if ahead > 0:
+                            self._stopping.wait(ahead)
+        except BaseException:
+            partial.unlink(missing_ok=True)
+            raise
+        shutil.copystat(path, partial)
+        os.replace(partial, target)
+        path.unlink()
+        return target
@@ -1,11 +1,28 @@
 import asyncio
 import aiohttp
-from typing import List, Union, Optional, Tuple
+from collections import Counter, deque
+from concurrent.futures import Executor
+from typing import (
+    Awaitable,
+    Callable,
+    Deque,
+    List,
+    NamedTuple,
+    Set,
+    Union,
+    Optional,
+    Tuple,
+)
 from yarl import URL
 from time import time
 from datetime import datetime
 import logging
 import math
+from .tsverify import SegmentReport, verify_segment
+from .seekindex import SeekIndexWriter, get_index_filename
+from .segmentcache import SegmentCache
+from .diagnostics import timed
+from .storage import OutputFile, StorageFullError, StorageManager
 
 
 logger = logging.getLogger(__name__)
@@ -15,29 +32,123 @@ class PlaylistLoadError(Exception):
     pass
 
 
+class Chunk(NamedTuple):
+    uri: str
+    duration: float
+    discontinuity: bool = False
+
+
+class BufferedSegment(NamedTuple):
+    sequence: int
+    duration: float
+    data: bytes
+    discontinuity: bool
+
+
 class StreamLoader(object):
+    __slots__ = (
+        "session",
+        "model_name",
+        "playlist_url",
+        "sequence_number",
+        "capture_task",
+        "loaded_bytes",
+        "log_msg_time",
+        "output_filename",
+        "throttle",
+        "executor",
+        "segments",
+        "live_window",
+        "verify_stats",
+        "start_policy",
+        "fetch_backlog",
+        "backlog_task",
+        "live_idle",
+        "requested_at",
+        "first_byte_delay",
+        "storage",
+        "cache",
+        "sequence_stats",
+        "idle_since",
+        "segment_buffer",
+        "buffer_sequence",
+        "buffer_discontinuities",
+        "pending_discontinuity",
+        "storage_full",
+    )
 
     session: aiohttp.ClientSession
     model_name: str
-    playlist_url: URL
+    playlist_url: Optional[URL]
     sequence_number: int
     capture_task: Optional[asyncio.Task]
     loaded_bytes: int
     # log_msg_time: float
     output_filename: Optional[str]
+    throttle: Optional[Callable[[int], Awaitable[None]]]
+    executor: Optional[Executor]
+    segments: Optional[asyncio.Queue]
+    live_window: Set[str]
+    verify_stats: Counter
+    # "full" window, "live" edge only, or number of seconds before the edge
+    start_policy: Union[str, float]
+    fetch_backlog: bool
+    backlog_task: Optional[asyncio.Task]
+    live_idle: asyncio.Event
+    requested_at: Optional[float]
+    first_byte_delay: Optional[float]
+    storage: StorageManager
+    cache: SegmentCache
+    sequence_stats: Counter
+    idle_since: float
+    # recent segments for local re-serving, None when disabled
+    segment_buffer: Optional[Deque[BufferedSegment]]
+    buffer_sequence: int
+    buffer_discontinuities: int
+    pending_discontinuity: bool
+    # the last capture stopped because the disk filled up
+    storage_full: bool
 
     def __init__(
         self,
         session: aiohttp.ClientSession,
         model_name: str,
+        throttle: Optional[Callable[[int], Awaitable[None]]] = None,
+        executor: Optional[Executor] = None,
+        start_policy: Union[str, float] = "full",
+        fetch_backlog: bool = False,
+        storage: Optional[StorageManager] = None,
+        buffer_segments: int = 0,
     ) -> None:
         self.session = session
         self.model_name = model_name
+        self.throttle = throttle
+        self.executor = executor
+        self.segments = None
+        self.live_window = set()
+        self.verify_stats = Counter()
+        self.start_policy = start_policy
+        self.fetch_backlog = fetch_backlog
+        self.backlog_task = None
+        self.live_idle = asyncio.Event()
+        self.requested_at = None
+        self.first_byte_delay = None
+        self.storage = storage if storage is not None else StorageManager()
+        self.cache = SegmentCache()
+        self.sequence_stats = Counter()
+        self.playlist_url = None
         self.sequence_number = 0
         self.loaded_bytes = 0
         self.capture_task = None
         self.log_msg_time = 0
         self.output_filename = None
+        self.idle_since = time()
+        self.segment_buffer = None
+        self.buffer_sequence = 0
+        self.buffer_discontinuities = 0
+        self.pending_discontinuity = False
+        self.storage_full = False
+        self.set_buffer_size(buffer_segments)
 
     @property
     def in_progress(self) -> bool:
@@ -51,7 +162,15 @@ class StreamLoader(object):
 
     @property
     def status(self) -> Optional[str]:
-        return f"{self.model_name}: -> {self.output_filename} {self.convert_size(self.loaded_bytes)}"
+        size = self.convert_size(self.loaded_bytes)
+        status = f"{self.model_name}: -> {self.output_filename} {size}"
+        if self.first_byte_delay is not None:
+            status += f" first byte after {self.first_byte_delay:.1f}s"
+        if self.verify_stats["corrupt"]:
+            status += " corrupt segments: {corrupt}, repaired: {repaired}".format(
+                **self.verify_stats
+            )
+        return status
 
     @staticmethod
     def convert_size(size_bytes: int) -> str:
@@ -67,24 +186,62 @@ class StreamLoader(object):
         timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
         return f"{self.model_name}_{timestamp}.mp4"
 
-    def start_capture(self, playlist_url: Union[str, URL]):
+    def set_buffer_size(self, buffer_segments: int):
+        if not buffer_segments:
+            self.segment_buffer = None
+        elif self.segment_buffer is None:
+            self.segment_buffer = deque(maxlen=buffer_segments)
+        elif self.segment_buffer.maxlen != buffer_segments:
+            self.segment_buffer = deque(self.segment_buffer, maxlen=buffer_segments)
+
+    def buffer_segment(self, data: bytes, duration: float):
+        buffer = self.segment_buffer
+        if len(buffer) == buffer.maxlen and buffer[0].discontinuity:
+            self.buffer_discontinuities += 1
+        # local numbering keeps growing across captures and upstream resets
+        segment = BufferedSegment(
+            self.buffer_sequence, duration, data, self.pending_discontinuity
+        )
+        buffer.append(segment)
+        self.buffer_sequence += 1
+        self.pending_discontinuity = False
+
+    def get_backlog_filename(self) -> str:
+        stem, _, ext = self.output_filename.rpartition(".")
+        return f"{stem}_backlog.{ext}"
+
+    def start_capture(
+        self, playlist_url: Union[str, URL], requested_at: Optional[float] = None
+    ):
         self.loaded_bytes = 0
         self.sequence_number = 0
+        self.verify_stats = Counter()
+        self.requested_at = requested_at if requested_at is not None else time()
+        self.first_byte_delay = None
+        self.cache.clear()
+        self.pending_discontinuity = self.buffer_sequence > 0
+        self.sequence_stats = Counter()
+        self.storage_full = False
         # self.log_msg_time = time()
         self.output_filename = self.get_filename()
+        self.playlist_url = URL(playlist_url)
         self.capture_task: asyncio.Task = asyncio.create_task(
             self.capture_stream(playlist_url)
         )
         self.capture_task.add_done_callback(self.task_done)
 
     def task_done(self, task: asyncio.Task):
-        self.capture_task = None
+        # a stopped task may finish after a new capture was started
+        if self.capture_task is task:
+            self.capture_task = None
+        self.idle_since = time()
 
     def stop_capture(self):
         if self.capture_task is not None:
             self.capture_task.cancel()
             self.capture_task = None
         self.output_filename = None
+        self.idle_since = time()
 
     async def load_playlist(self, playlist_url: Union[str, URL]) -> str:
         max_tries = 10
@@ -118,6 +275,103 @@ class StreamLoader(object):
 
         # change replace playlist path to chunklist path
         chl_url = playlist_url.join(URL(chl_url))
+        self.segments = asyncio.Queue(maxsize=32)
+        writer_task = asyncio.create_task(self.write_segments())
+        load_task = asyncio.create_task(self.load_chunks(playlist_url, chl_url))
+        try:
+            await asyncio.wait(
+                {load_task, writer_task}, return_when=asyncio.FIRST_COMPLETED
+            )
+            if not writer_task.done():
+                # let the writer drain what is already downloaded
+                await self.segments.put(None)
+            await writer_task
+            if load_task.done():
+                load_task.result()
+        except StorageFullError as e:
+            self.storage_full = True
+            logger.error(f"{self.model_name}: capture stopped, {e}")
+        finally:
+            tasks = {load_task, writer_task}
+            if self.backlog_task is not None:
+                tasks.add(self.backlog_task)
+                self.backlog_task = None
+            for task in tasks:
+                task.cancel()
+            # the writers close and hand over their files on the way out
+            await asyncio.wait(tasks)
+            self.segments = None
+
+    def get_start_index(self, chunks: List[Chunk]) -> int:
+        if not chunks or self.start_policy == "full":
+            return 0
+        if self.start_policy == "live":
+            return len(chunks) - 1
+        duration = 0.0
+        for index in range(len(chunks) - 1, -1, -1):
+            duration += chunks[index].duration
+            if duration >= float(self.start_policy):
+                return index
+        return 0
+
+    async def load_backlog(
+        self, playlist_url: URL, first_sequence: int, chunks: List[Chunk]
+    ):
+        loop = asyncio.get_running_loop()
+        filename = self.get_backlog_filename()
+        output: Optional[OutputFile] = None
+        index: Optional[SeekIndexWriter] = None
+        try:
+            for seq_number, chunk in enumerate(chunks, first_sequence):
+                # backlog only uses the gaps between live chunklist refreshes
+                await self.live_idle.wait()
+                if self.cache.seen_name(chunk.uri):
+                    continue
+                chunk_url = playlist_url.join(URL(chunk.uri))
+                try:
+                    data = await self.load_resource(chunk_url, raw=True)
+                except aiohttp.ClientResponseError:
+                    logger.debug(
+                        "%s: backlog chunk %s is gone", self.model_name, chunk.uri
+                    )
+                    continue
+                loaded_at = time()
+                self.loaded_bytes += len(data)
+                if self.throttle is not None:
+                    await self.throttle(len(data))
+                verification = loop.run_in_executor(
+                    self.executor, verify_segment, data
+                )
+                self.cache.add_name(chunk.uri)
+                checked = await self.check_segment(
+                    chunk, chunk_url, data, verification
+                )
+                if checked is None:
+                    continue
+                data, report = checked
+                self.storage.check_space()
+                if output is None:
+                    output = self.storage.open_output(filename)
+                    index = SeekIndexWriter(get_index_filename(output.path))
+                offset = output.write(data, chunk.duration)
+                index.add_segment(
+                    seq_number,
+                    loaded_at,
+                    chunk.duration,
+                    offset,
+                    len(data),
+                    report.keyframes,
+                )
+        except StorageFullError as e:
+            logger.error(f"{self.model_name}: backlog stopped, {e}")
+        finally:
+            if output is not None:
+                self.close_output(output, index)
+                logger.info(f"{self.model_name}: backlog saved to {output.path}")
+
+    @timed("StreamLoader.load_chunks")
+    async def load_chunks(self, playlist_url: URL, chl_url: URL):
+        loop = asyncio.get_running_loop()
         broken_chunks_count = 0
         max_broken_chunks = 5
         while broken_chunks_count < max_broken_chunks:
@@ -132,16 +386,60 @@ class StreamLoader(object):
                 return
             seq_number, total_duration, chunks = self.parse_chunklist(chl)
             cl_start = time()
+            self.live_window = {chunk.uri for chunk in chunks}
+            self.live_idle.clear()
 
             # if chunklist loaded for the first time
             if self.sequence_number == 0:
+                start_index = self.get_start_index(chunks)
+                self.sequence_number = seq_number + start_index
+                if start_index and self.fetch_backlog:
+                    self.backlog_task = asyncio.create_task(
+                        self.load_backlog(
+                            playlist_url, seq_number, chunks[:start_index]
+                        )
+                    )
+                chunks = chunks[start_index:]
+
+            elif seq_number > self.sequence_number:
+                # the window moved past segments we never saw
+                gap = seq_number - self.sequence_number
+                logger.warning("%s: %d segments missed", self.model_name, gap)
+                self.sequence_stats["missed"] += gap
+                self.pending_discontinuity = True
                 self.sequence_number = seq_number
 
             # slice already loaded chunks from list
-            if self.sequence_number > seq_number:
-                chunks = chunks[self.sequence_number - seq_number :]
-            for chunk in chunks:
-                chunk_url = playlist_url.join(URL(chunk))
+            elif self.sequence_number > seq_number:
+                index = self.sequence_number - seq_number
+                if index > len(chunks) or not self.cache.seen_name(
+                    chunks[index - 1].uri
+                ):
+                    # the sequence went backwards, the edge restarted
+                    # numbering and may reuse names for new content;
+                    # re-read the window and let the fingerprints drop
+                    # segments already written
+                    logger.warning(
+                        "%s: media sequence reset %d -> %d",
+                        self.model_name,
+                        self.sequence_number,
+                        seq_number,
+                    )
+                    self.sequence_stats["resets"] += 1
+                    self.pending_discontinuity = True
+                    self.sequence_number = seq_number
+                    self.cache.forget_names()
+                    index = 0
+                chunks = chunks[index:]
+            for seq_number, chunk in enumerate(chunks, self.sequence_number):
+                # numbers come from the chunklist, a failed download keeps its slot
+                self.sequence_number = seq_number + 1
+                if chunk.discontinuity:
+                    self.sequence_stats["discontinuities"] += 1
+                if self.cache.seen_name(chunk.uri):
+                    self.sequence_stats["duplicates"] += 1
+                    continue
+                chunk_url = playlist_url.join(URL(chunk.uri))
                 try:
                     data = await self.load_resource(chunk_url, raw=True)
                     if len(data) == 0:
@@ -149,25 +447,146 @@ class StreamLoader(object):
                         continue
                 except aiohttp.client_exceptions.ClientResponseError as e:
                     logger.warning(
-                        "{}: Cannot load video chunk, HTTPstatus: {}".format(
-                            self.model_name, e.status
-                        )
+                        "%s: Cannot load video chunk, HTTPstatus: %s",
+                        self.model_name,
+                        e.status,
                     )
                     broken_chunks_count += 1
                     continue
                 self.loaded_bytes += len(data)
+                if self.throttle is not None:
+                    await self.throttle(len(data))
 
-                with open(self.output_filename, "ab") as fd:
-                    fd.write(data)
-                self.sequence_number += 1
+                # verification runs in the executor while the next chunk loads
+                verification = loop.run_in_executor(
+                    self.executor, verify_segment, data
+                )
+                self.cache.add_name(chunk.uri)
+                await self.segments.put(
+                    (seq_number, time(), chunk, chunk_url, data, verification)
+                )
             load_duration = time() - cl_start
+            self.live_idle.set()
             if load_duration < total_duration / 2:
                 await asyncio.sleep(total_duration / 4)
+            else:
+                # give the backlog a turn even when the live edge is busy
+                await asyncio.sleep(0)
             # ct = time()
             # if ct - self.log_msg_time >= 6:
             #     logger.info(self.status)
             #     self.log_msg_time = ct
 
+    async def write_segments(self):
+        output: Optional[OutputFile] = None
+        index: Optional[SeekIndexWriter] = None
+        try:
+            while True:
+                item = await self.segments.get()
+                if item is None:
+                    return
+                output, index = await self.write_segment(item, output, index)
+        finally:
+            if output is not None:
+                self.close_output(output, index)
+
+    def close_output(self, output: OutputFile, index: SeekIndexWriter):
+        output.close()
+        index.close()
+        self.storage.finish(output.path, index.path)
+
+    def get_next_filename(self, current: str) -> str:
+        filename = self.get_filename()
+        stem, _, ext = filename.rpartition(".")
+        part = 1
+        while filename == current or self.storage.get_path(filename).exists():
+            filename = f"{stem}_{part}.{ext}"
+            part += 1
+        return filename
+
+    @timed("StreamLoader.write_segment")
+    async def write_segment(
+        self,
+        item: tuple,
+        output: Optional[OutputFile],
+        index: Optional[SeekIndexWriter],
+    ) -> Tuple[Optional[OutputFile], Optional[SeekIndexWriter]]:
+        seq_number, loaded_at, chunk, chunk_url, data, verification = item
+        checked = await self.check_segment(chunk, chunk_url, data, verification)
+        if checked is None:
+            return output, index
+        data, report = checked
+        self.storage.check_space()
+        if output is not None and (
+            self.storage.should_rotate(output, len(data), chunk.duration)
+            # a sequence reset starts a new file with its own index
+            or not index.accepts(seq_number)
+        ):
+            self.close_output(output, index)
+            output = None
+            self.output_filename = self.get_next_filename(self.output_filename)
+        if output is None:
+            output = self.storage.open_output(self.output_filename)
+            index = SeekIndexWriter(get_index_filename(output.path))
+        offset = output.write(data, chunk.duration)
+        index.add_segment(
+            seq_number, loaded_at, chunk.duration, offset, len(data), report.keyframes
+        )
+        if self.segment_buffer is not None:
+            self.buffer_segment(data, chunk.duration)
+        if self.first_byte_delay is None:
+            self.first_byte_delay = time() - self.requested_at
+            logger.info(
+                f"{self.model_name}: first segment on disk "
+                f"{self.first_byte_delay:.2f}s after going live"
+            )
+        return output, index
+
+    @timed("StreamLoader.check_segment")
+    async def check_segment(
+        self,
+        chunk: Chunk,
+        chunk_url: URL,
+        data: bytes,
+        verification: Awaitable[SegmentReport],
+    ) -> Optional[Tuple[bytes, SegmentReport]]:
+        # None when the segment was already written
+        report = await verification
+        self.verify_stats["verified"] += 1
+        if self.cache.seen_fingerprint(report.fingerprint):
+            logger.debug("%s: %s already written", self.model_name, chunk_url.name)
+            self.sequence_stats["duplicates"] += 1
+            return None
+        if not report.ok:
+            data, report = await self.refetch_segment(
+                chunk, chunk_url, data, report
+            )
+        self.cache.add_fingerprint(report.fingerprint)
+        return data, report
+
+    async def refetch_segment(
+        self, chunk: Chunk, chunk_url: URL, data: bytes, report: SegmentReport
+    ) -> Tuple[bytes, SegmentReport]:
+        self.verify_stats["corrupt"] += 1
+        logger.warning(
+            "%s: corrupt segment %s %s", self.model_name, chunk_url.name, report
+        )
+        if chunk.uri not in self.live_window:
+            return data, report
+        self.verify_stats["refetched"] += 1
+        try:
+            new_data = await self.load_resource(chunk_url, raw=True)
+        except aiohttp.ClientResponseError:
+            return data, report
+        loop = asyncio.get_running_loop()
+        new_report = await loop.run_in_executor(
+            self.executor, verify_segment, new_data
+        )
+        if new_report.errors >= report.errors:
+            return data, report
+        if new_report.ok:
+            self.verify_stats["repaired"] += 1
+        return new_data, new_report
 
     async def load_resource(self, url: Union[str, URL], raw=False):
         resp: aiohttp.ClientResponse
@@ -182,10 +601,12 @@ class StreamLoader(object):
         return None
 
     @staticmethod
-    def parse_chunklist(chunklist: str) -> Tuple[int, float, List[str]]:
+    def parse_chunklist(chunklist: str) -> Tuple[int, float, List[Chunk]]:
         sequence_number: int = 0
         total_duration: float = 0
-        chunks: List[str] = []
+        duration: float = 0
+        discontinuity = False
+        chunks: List[Chunk] = []
         for string in chunklist.split("\n"):
             if string.startswith("#EXT-X-MEDIA-SEQUENCE"):
                 try:
@@ -194,10 +615,14 @@ class StreamLoader(object):
                     pass
             elif string.startswith("#EXTINF"):
                 try:
-                    total_duration += float(string.split(":")[-1][:-1])
+                    duration = float(string.split(":")[-1][:-1])
+                    total_duration += duration
                 except ValueError:
                     pass
+            elif string.startswith("#EXT-X-DISCONTINUITY") and ":" not in string:
+                discontinuity = True
             elif string.startswith("media"):
-                chunks.append(string)
+                chunks.append(Chunk(string, duration, discontinuity))
+                discontinuity = False
 
         return (sequence_number, total_duration, chunks)
@@ -0,0 +1,190 @@
+import zlib
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+TS_PACKET_SIZE = 188
+SYNC_BYTE = 0x47
+NULL_PID = 0x1FFF
+PES_START_CODE = b"\x00\x00\x01"
+# PES stream_id range of video elementary streams
+VIDEO_STREAM_IDS = range(0xE0, 0xF0)
+
+
+@dataclass
+class SegmentReport:
+    size: int
+    packets: int = 0
+    misaligned: bool = False
+    sync_errors: int = 0
+    continuity_errors: int = 0
+    crc32: int = 0
+    # byte offsets of video packets starting a random access point
+    keyframes: List[int] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return (
+            self.packets > 0
+            and not self.misaligned
+            and not self.sync_errors
+            and not self.continuity_errors
+        )
+
+    @property
+    def fingerprint(self) -> Tuple[int, int]:
+        return (self.size, self.crc32)
+
+    @property
+    def errors(self) -> int:
+        return int(self.misaligned) + self.sync_errors + self.continuity_errors
+
+
+# continuity counter of the next packet of the same PID, upper bits kept
+_NEXT_CC = bytes((v & 0xF0) | ((v + 1) & 0x0F) for v in range(256))
+_NONZERO = bytes([0]) + bytes([1]) * 255
+_ADAPTATION = bytes(int(bool(v & 0x20)) for v in range(256))
+# discontinuity_indicator or random_access_indicator
+_INDICATORS = bytes(int(bool(v & 0xC0)) for v in range(256))
+_CC_AND_PAYLOAD = bytes(v & 0x1F for v in range(256))
+_PID_HIGH = bytes(v & 0x1F for v in range(256))
+# codes of packets of another PID (bit 7) or without payload (no bit 4)
+_NOT_COUNTED = bytes(v for v in range(256) if v & 0x80 or not v & 0x10)
+# more PIDs than this and the per-packet loop is cheaper
+MAX_FAST_PIDS = 16
+
+
+@lru_cache(maxsize=None)
+def _other_than(value: int) -> bytes:
+    # translate table marking every byte except ``value`` with 1
+    return bytes(int(v != value) for v in range(256))
+
+
+def count_continuity_errors(view: memoryview) -> int:
+    """Reference per-packet check, used when the fast path does not apply."""
+    errors = 0
+    last_cc: Dict[int, int] = {}
+    for offset in range(0, len(view), TS_PACKET_SIZE):
+        pid = ((view[offset + 1] & 0x1F) << 8) | view[offset + 2]
+        if pid == NULL_PID:
+            continue
+        flags = view[offset + 3]
+        cc = flags & 0x0F
+        if flags & 0x20 and view[offset + 4] and view[offset + 5] & 0x80:
+            # discontinuity_indicator resets the counter
+            last_cc[pid] = cc
+            continue
+        if not flags & 0x10:
+            # no payload, counter does not advance
+            continue
+        prev = last_cc.get(pid)
+        last_cc[pid] = cc
+        if prev is not None and cc != (prev + 1) & 0x0F and cc != prev:
+            errors += 1
+    return errors
+
+
+def count_continuity_errors_fast(data: bytes, packets: int) -> Optional[int]:
+    """Same result as count_continuity_errors without a per-packet loop.
+
+    Works on one byte per packet and one PID at a time: packets of other
+    PIDs are masked out with bytes.translate and big int OR, and the
+    counters left are compared with their predecessors the same way.
+    Returns None for streams with too many PIDs.
+    """
+    end = packets * TS_PACKET_SIZE
+    high = data[1:end:TS_PACKET_SIZE].translate(_PID_HIGH)
+    low = data[2:end:TS_PACKET_SIZE]
+    flags = int.from_bytes(data[3:end:TS_PACKET_SIZE].translate(_CC_AND_PAYLOAD), "big")
+    # one byte per packet, 1 while its PID is not checked yet
+    remaining = int.from_bytes(bytes([1]) * packets, "big")
+    errors = 0
+    for _ in range(MAX_FAST_PIDS):
+        index = remaining.to_bytes(packets, "big").find(1)
+        if index < 0:
+            return errors
+        pid_high, pid_low = high[index], low[index]
+        other = int.from_bytes(high.translate(_other_than(pid_high)), "big")
+        other |= int.from_bytes(low.translate(_other_than(pid_low)), "big")
+        remaining &= other
+        if (pid_high << 8) | pid_low == NULL_PID:
+            continue
+        # bit 0 of each byte moves to bit 7 of the same byte
+        codes = ((other << 7) | flags).to_bytes(packets, "big")
+        counters = codes.translate(None, _NOT_COUNTED)
+        if len(counters) < 2:
+            continue
+        size = len(counters) - 1
+        prev, cur = counters[:-1], int.from_bytes(counters[1:], "big")
+        skipped = cur ^ int.from_bytes(prev.translate(_NEXT_CC), "big")
+        repeated = cur ^ int.from_bytes(prev, "big")
+        # a counter is wrong unless it is the next one or a repeat
+        skipped = skipped.to_bytes(size, "big").translate(_NONZERO)
+        repeated = repeated.to_bytes(size, "big").translate(_NONZERO)
+        both = int.from_bytes(skipped, "big") & int.from_bytes(repeated, "big")
+        errors += both.to_bytes(size, "big").count(1)
+    return None
+
+
+def is_video_pes(view: memoryview, offset: int) -> bool:
+    start = offset + 5 + view[offset + 4]
+    if start + 4 > offset + TS_PACKET_SIZE:
+        return False
+    return (
+        view[start:start + 3] == PES_START_CODE
+        and view[start + 3] in VIDEO_STREAM_IDS
+    )
+
+
+def verify_segment(data: bytes) -> SegmentReport:
+    """Check an MPEG-TS segment for sync loss, truncation and lost packets.
+
+    Pure CPU work, meant to be run in an executor off the event loop. Only
+    packets flagged as keyframe or discontinuity are looked at one by one,
+    everything else is bytes.translate and big int arithmetic over header
+    bytes, see benchmarks/bench_tsverify.py.
+    """
+    report = SegmentReport(size=len(data), crc32=zlib.crc32(data))
+    report.misaligned = len(data) % TS_PACKET_SIZE != 0
+    report.packets = len(data) // TS_PACKET_SIZE
+    if not report.packets:
+        return report
+
+    end = report.packets * TS_PACKET_SIZE
+    view = memoryview(data)[:end]
+    # strided slices of the bytes are much cheaper than of the memoryview
+    sync = data[0:end:TS_PACKET_SIZE]
+    report.sync_errors = report.packets - sync.count(SYNC_BYTE)
+    if report.sync_errors:
+        # continuity counters are meaningless once the stream lost sync
+        return report
+
+    # packets with an adaptation field carrying either indicator
+    flagged = (
+        int.from_bytes(data[3:end:TS_PACKET_SIZE].translate(_ADAPTATION), "big")
+        & int.from_bytes(data[4:end:TS_PACKET_SIZE].translate(_NONZERO), "big")
+        & int.from_bytes(data[5:end:TS_PACKET_SIZE].translate(_INDICATORS), "big")
+    ).to_bytes(report.packets, "big")
+    discontinuity = False
+    index = flagged.find(1)
+    while index >= 0:
+        offset = index * TS_PACKET_SIZE
+        indicators = view[offset + 5]
+        if indicators & 0x80:
+            discontinuity = True
+        # muxers flag every audio PES as well, only video ones count
+        if (
+            indicators & 0x40
+            and view[offset + 1] & 0x40
+            and is_video_pes(view, offset)
+        ):
+            report.keyframes.append(offset)
+        index = flagged.find(1, index + 1)
+
+    errors = None
+    if not discontinuity:
+        errors = count_continuity_errors_fast(data, report.packets)
+    if errors is None:
+        errors = count_continuity_errors(view)
+    report.continuity_errors = errors
+    return report
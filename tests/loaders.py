@@ -0,0 +1,11 @@
+import asyncio
+from myfreecams.streamloader import StreamLoader
+
+
+class IdleLoader(StreamLoader):
+    # captures that never finish by themselves
+    def get_filename(self) -> str:
+        return f"{self.model_name}.mp4"
+
+    async def capture_stream(self, playlist_url):
+        await asyncio.sleep(3600)
@@ -34,8 +34,7 @@ async def chunklist(request: web.Request):
 
 
 async def chunk(request: web.Request):
-    request.match_info["cn"]
-    chunk = b"chunk"
+    chunk = f"chunk{request.match_info['cn']}".encode()
     return web.Response(body=chunk)
 
 async def text(request: web.Request) -> web.Response:
@@ -0,0 +1,38 @@
+import asyncio
+import pytest
+from myfreecams import backends
+from myfreecams.mfcwschat import Message
+
+TEXT = "10 0 0 0 0 %7B%22nm%22%3A%20%22Foo%22%2C%20%22vs%22%3A%200%7D"
+
+
+@pytest.fixture
+def restore_backend():
+    yield
+    backends.use_json_backend()
+
+
+@pytest.mark.parametrize("name", ["json", "orjson"])
+def test_json_backends(name: str, restore_backend):
+    if name == "orjson":
+        pytest.importorskip("orjson")
+    assert backends.use_json_backend(name) == name
+    message = Message.from_text(TEXT)
+    assert message.payload == {"nm": "Foo", "vs": 0}
+    # undecodable payloads are kept as text
+    assert Message.from_text("10 0 0 0 0 {broken").payload == "{broken"
+
+
+def test_unknown_backends(restore_backend):
+    with pytest.raises(ValueError):
+        backends.use_json_backend("simdjson")
+    with pytest.raises(ValueError):
+        backends.new_event_loop("trio")
+
+
+def test_new_event_loop():
+    loop = backends.new_event_loop("asyncio")
+    try:
+        assert loop.run_until_complete(asyncio.sleep(0, result=1)) == 1
+    finally:
+        loop.close()
@@ -0,0 +1,56 @@
+import json
+from pathlib import Path
+from urllib.parse import quote
+import pytest
+from myfreecams.chatrecorder import (
+    ChatRecorder,
+    ChatReplay,
+    RecordingFormatError,
+    read_frames,
+)
+
+
+def make_frame(*messages: str) -> str:
+    return "".join(f"{len(m):06d}{m}" for m in messages)
+
+
+def model_message(name: str, vs: int) -> str:
+    payload = quote(json.dumps({"nm": name, "vs": vs, "uid": 1}))
+    return f"10 0 0 0 0 {payload}"
+
+
+@pytest.fixture(params=["chat.rec", "chat.rec.gz"])
+def recording(tmp_path: Path, request) -> Path:
+    path = tmp_path / request.param
+    with ChatRecorder(path) as recorder:
+        recorder.record(make_frame(model_message("Foo", 0)), timestamp=100.0)
+        recorder.record(
+            make_frame(model_message("Bar", 90), "0 0 0 0 0"), timestamp=100.5
+        )
+        # a frame without messages must not end the replay
+        recorder.record("", timestamp=100.7)
+        recorder.record(make_frame(model_message("Foo", 90)), timestamp=101.0)
+    return path
+
+
+def test_read_frames(recording: Path):
+    frames = list(read_frames(recording))
+    assert [ts for ts, _ in frames] == [100.0, 100.5, 100.7, 101.0]
+    assert frames[0][1] == make_frame(model_message("Foo", 0))
+
+
+def test_read_frames_bad_file(tmp_path: Path):
+    path = tmp_path / "garbage.rec"
+    path.write_bytes(b"not a recording")
+    with pytest.raises(RecordingFormatError):
+        list(read_frames(path))
+
+
+async def test_replay(recording: Path):
+    replay = ChatReplay(recording, speed=None)
+    await replay.connect()
+    messages = [message async for message in replay]
+    assert [m.n_type for m in messages] == [10, 10, 0, 10]
+    assert messages[0].payload["nm"] == "Foo"
+    assert messages[-1].payload["vs"] == 90
+    assert not replay.connected
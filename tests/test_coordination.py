@@ -0,0 +1,65 @@
+from pathlib import Path
+import pytest
+from pytest import fixture
+from myfreecams.coordination import (
+    LeaseBackend,
+    LeaseCoordinator,
+    LeaseStore,
+    MemoryLeaseStore,
+    SqliteLeaseBackend,
+    StoreLeaseBackend,
+)
+
+
+@fixture(params=["sqlite", "store"])
+def backend(request, tmp_path: Path):
+    if request.param == "sqlite":
+        return SqliteLeaseBackend(tmp_path / "leases.db")
+    return StoreLeaseBackend(MemoryLeaseStore())
+
+
+async def test_exclusive_lease(backend, loop):
+    assert await backend.acquire("foo", "host1", 30)
+    assert not await backend.acquire("foo", "host2", 30)
+    assert await backend.acquire("foo", "host1", 30)
+    assert await backend.renew("foo", "host1", 30)
+    assert not await backend.renew("foo", "host2", 30)
+    await backend.release("foo", "host2")
+    assert (await backend.get("foo")).owner == "host1"
+    await backend.release("foo", "host1")
+    assert await backend.acquire("foo", "host2", 30)
+
+
+async def test_expired_lease(backend, loop):
+    assert await backend.acquire("foo", "host1", -1)
+    assert await backend.acquire("foo", "host2", 30)
+    assert not await backend.renew("foo", "host1", 30)
+
+
+async def test_coordinator_takeover(backend, loop):
+    lost = []
+    first = LeaseCoordinator(backend, owner="host1", ttl=30, on_lost=lost.append)
+    second = LeaseCoordinator(backend, owner="host2", ttl=30)
+    started = []
+    assert await first.acquire("foo")
+    assert not await second.acquire("foo")
+    second.wait_for("foo", lambda: started.append("foo"))
+    await second.refresh()
+    assert not started
+
+    await first.stop()
+    await second.refresh()
+    assert started == ["foo"]
+    assert second.held == {"foo"}
+
+    # host1 comes back, its old lease is gone
+    first.held.add("foo")
+    await first.refresh()
+    assert lost == ["foo"]
+    await second.stop()
+
+
+def test_interfaces_are_abstract():
+    for interface in (LeaseBackend, LeaseStore):
+        with pytest.raises(TypeError):
+            interface()
@@ -0,0 +1,48 @@
+import json
+import logging
+from pathlib import Path
+import pytest
+from myfreecams.config import GrabberConfig, ConfigError
+from myfreecams.daemon import GrabberDaemon
+from myfreecams.mfcgrabber import MfcGrabber
+from myfreecams.streamloader import StreamLoader
+
+
+def write_config(path: Path, **config):
+    path.write_text(json.dumps(config))
+
+
+def test_load_config(tmp_path: Path):
+    path = tmp_path / "config.json"
+    write_config(path, models=["Foo", "bar"])
+    assert GrabberConfig.load(path).models == ["foo", "bar"]
+    write_config(path, modles=["Foo"])
+    with pytest.raises(ConfigError):
+        GrabberConfig.load(path)
+
+
+async def test_reload(tmp_path: Path, loop, caplog):
+    path = tmp_path / "config.json"
+    write_config(path, models=["Foo", "Bar"])
+    daemon = GrabberDaemon(path)
+    daemon.grabber = await MfcGrabber.create(models=daemon.config.models)
+    daemon.grabber.streams["Foo"] = StreamLoader(daemon.grabber.session, "Foo")
+
+    write_config(path, models=["Bar", "Baz"])
+    await daemon.reload()
+    assert sorted(daemon.grabber.models) == ["bar", "baz"]
+    assert "Foo" not in daemon.grabber.streams
+
+    # startup settings are kept until a restart, the rest applies live
+    write_config(path, models=["Bar", "Baz"], work_dir="elsewhere", max_captures=2)
+    with caplog.at_level(logging.WARNING):
+        await daemon.reload()
+    assert "work_dir" in caplog.text
+    assert daemon.config.work_dir == "."
+    assert daemon.grabber.governor.max_captures == 2
+
+    # broken config keeps the current model list
+    path.write_text("{")
+    await daemon.reload()
+    assert sorted(daemon.config.models) == ["bar", "baz"]
+    await daemon.stop()
@@ -0,0 +1,72 @@
+import asyncio
+import pstats
+import pytest
+import time
+import tracemalloc
+from pathlib import Path
+from myfreecams.diagnostics import Diagnostics, timed, timings
+
+
+@timed("test.sleep")
+async def sleep(delay: float):
+    await asyncio.sleep(delay)
+
+
+@timed("test.work")
+async def work(busy: float, idle: float):
+    time.sleep(busy)
+    await asyncio.sleep(idle)
+    time.sleep(busy)
+    if busy > idle:
+        raise ValueError(busy)
+    return busy
+
+
+async def test_timed(loop):
+    await sleep(0.01)
+    await sleep(0)
+    assert timings["test.sleep"].calls == 2
+    assert timings["test.sleep"].max >= 0.01
+
+    assert await work(0.01, 0.1) == 0.01
+    timing = timings["test.work"]
+    assert timing.max >= 0.12
+    # the time suspended in asyncio.sleep is not busy time
+    assert 0.02 <= timing.busy_max < 0.06
+    with pytest.raises(ValueError):
+        await work(0.02, 0)
+    task = asyncio.ensure_future(work(0, 10))
+    await asyncio.sleep(0)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert timing.calls == 3
+    assert "busy avg=" in str(timing)
+
+
+async def test_lag_and_stall(loop):
+    diagnostics = Diagnostics(interval=0.05, stall_threshold=0.1)
+    diagnostics.start()
+    await asyncio.sleep(0.1)
+    time.sleep(0.3)  # block the loop
+    await asyncio.sleep(0.1)
+    await diagnostics.stop()
+    assert diagnostics.stalls == 1
+    assert diagnostics.lag_max >= 0.2
+    assert "loop lag" in diagnostics.status
+
+
+async def test_dumps(loop, tmp_path: Path):
+    diagnostics = Diagnostics(tmp_path)
+    assert diagnostics.toggle_profile() is None
+    await sleep(0)
+    profile = diagnostics.toggle_profile()
+    assert pstats.Stats(str(profile)).total_calls > 0
+
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+        assert diagnostics.snapshot_memory() is None
+    snapshot = diagnostics.snapshot_memory()
+    assert tracemalloc.Snapshot.load(str(snapshot)) is not None
+    if not was_tracing:
+        tracemalloc.stop()
@@ -0,0 +1,107 @@
+import asyncio
+from pytest import fixture
+from aiohttp import ClientSession
+from myfreecams.governor import CaptureGovernor
+from loaders import IdleLoader
+
+
+@fixture
+async def session(loop):
+    session = ClientSession()
+    yield session
+    await session.close()
+
+
+async def test_queue_and_admit(session: ClientSession):
+    governor = CaptureGovernor(max_captures=1)
+    foo, bar = IdleLoader(session, "Foo"), IdleLoader(session, "Bar")
+    assert governor.request(foo, "http://localhost/foo.m3u8") == "admitted"
+    assert governor.request(bar, "http://localhost/bar.m3u8") == "queued"
+    assert foo.in_progress and not bar.in_progress
+    assert governor.is_pending(bar)
+
+    governor.cancel(foo)
+    assert bar.in_progress
+    assert not governor.is_pending(bar)
+    governor.cancel(bar)
+    await asyncio.sleep(0)
+    assert governor.metrics["admitted"] == 2
+    assert not governor.active
+
+
+async def test_preempt(session: ClientSession):
+    governor = CaptureGovernor(max_captures=1, preempt=True, priorities={"bar": 5})
+    foo, bar = IdleLoader(session, "Foo"), IdleLoader(session, "Bar")
+    governor.request(foo, "http://localhost/foo.m3u8")
+    assert governor.request(bar, "http://localhost/bar.m3u8") == "preempted"
+    assert bar.in_progress and not foo.in_progress
+    assert governor.is_pending(foo)
+    # lower priority cannot preempt back
+    governor.cancel(bar)
+    await asyncio.sleep(0)
+    assert foo.in_progress
+    governor.cancel(foo)
+
+
+async def test_queue_entries(session: ClientSession):
+    governor = CaptureGovernor(max_captures=1)
+    foo, bar, baz = (IdleLoader(session, name) for name in ("Foo", "Bar", "Baz"))
+    governor.request(foo, "http://localhost/foo.m3u8")
+    # a model flapping while all slots are taken keeps one queue entry
+    for _ in range(3):
+        assert governor.request(bar, "http://localhost/bar.m3u8") == "queued"
+        governor.cancel(bar)
+    assert governor.queue == []
+    governor.request(bar, "http://localhost/bar.m3u8")
+    governor.request(baz, "http://localhost/baz.m3u8")
+    assert len(governor.queue) == 2
+
+    # a reload reorders models that are already queued
+    governor.configure(max_captures=1, priorities={"baz": 5})
+    governor.cancel(foo)
+    assert baz.in_progress and not bar.in_progress
+    governor.cancel(baz)
+    assert bar.in_progress
+    governor.cancel(bar)
+
+
+async def test_throttle(session: ClientSession):
+    governor = CaptureGovernor(max_bytes_per_second=1000)
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    await governor.throttle(1000)
+    await governor.throttle(200)
+    assert loop.time() - start >= 0.15
+    assert governor.metrics["throttled"] == 1
+
+
+async def test_admission(session: ClientSession):
+    governor = CaptureGovernor(max_captures=1, preempt=True, priorities={"bar": 5})
+    allowed = {"foo", "bar"}
+    stopped = []
+
+    async def admission(loader, playlist_url, requested_at):
+        return loader.model_name.lower() in allowed
+
+    governor.admission = admission
+    governor.on_stopped = lambda loader: stopped.append(loader.model_name)
+    foo, bar, baz = (IdleLoader(session, name) for name in ("Foo", "Bar", "Baz"))
+    assert governor.request(foo, "http://localhost/foo.m3u8") == "admitted"
+    # the slot is held while admission runs
+    assert governor.request(baz, "http://localhost/baz.m3u8") == "queued"
+    await asyncio.sleep(0)
+    assert foo.in_progress
+
+    assert governor.request(bar, "http://localhost/bar.m3u8") == "preempted"
+    assert stopped == ["Foo"]
+    await asyncio.sleep(0)
+    assert bar.in_progress
+
+    # baz is refused and gives its slot to foo
+    governor.cancel(bar)
+    await asyncio.sleep(0)
+    await asyncio.sleep(0)
+    assert not baz.in_progress and not governor.is_pending(baz)
+    assert foo.in_progress
+    assert governor.metrics["refused"] == 1
+    governor.cancel(foo)
@@ -1,8 +1,45 @@
+import asyncio
 from myfreecams.mfcgrabber import MfcGrabber
 from pytest import fixture
 from server import server
+from loaders import IdleLoader
 from myfreecams.mfcgrabber import MfcGrabber
+from myfreecams.governor import CaptureGovernor
+from myfreecams.storage import StorageManager
 from myfreecams.mfcwschat import Message
+from myfreecams.chatrecorder import ChatRecorder, ChatReplay
+from myfreecams.coordination import (
+    LeaseCoordinator,
+    MemoryLeaseStore,
+    StoreLeaseBackend,
+)
+
+
+class WritingLoader(IdleLoader):
+    async def capture_stream(self, playlist_url):
+        output = self.storage.open_output(self.output_filename)
+        try:
+            await asyncio.sleep(3600)
+        finally:
+            await asyncio.sleep(0)
+            output.close()
+            self.storage.finish(output.path)
+
+
+class FullDiskLoader(IdleLoader):
+    async def capture_stream(self, playlist_url):
+        self.storage_full = True
+
+
+def online(model_name: str) -> Message:
+    payload = {"vs": 0, "nm": model_name, "uid": 321, "u": {"camserv": "1"}}
+    return Message(10, 0, 0, 0, 0, payload=payload)
+
+
+async def settle(grabber: MfcGrabber):
+    while grabber.governor.starting:
+        await asyncio.gather(*grabber.governor.starting.values())
+    await asyncio.sleep(0)
 
 
 @fixture
@@ -22,3 +59,122 @@ async def test_handle_model(mfc_grabber: MfcGrabber):
         payload = {"vs": 0, "nm": model, "uid": 321, "u": {"camserv": '1'}}
         msg = Message(10, 0, 0, 0, 0, payload=payload)
         await mfc_grabber.handle_model(msg)
+
+
+async def test_replay_dispatch(tmp_path, loop):
+    path = tmp_path / "chat.rec"
+    with ChatRecorder(path) as recorder:
+        recorder.record('00004410 0 0 0 0 {"nm": "Foo", "vs": 90, "uid": 1}')
+    grabber = await MfcGrabber.create(
+        models=["Foo"], chat=ChatReplay(path, speed=None)
+    )
+    await grabber.replay()
+    assert "Foo" in grabber.streams
+    assert not grabber.streams["Foo"].in_progress
+    await grabber.stop()
+
+
+async def test_handle_model_leased_elsewhere(loop):
+    backend = StoreLeaseBackend(MemoryLeaseStore())
+    await backend.acquire("foo", "other-host", 30)
+    grabber = await MfcGrabber.create(
+        models=["Foo"], coordinator=LeaseCoordinator(backend, owner="this-host")
+    )
+    grabber.server_config = {"h5video_servers": {"1": "video1"}}
+    await grabber.handle_model(online("Foo"))
+    await settle(grabber)
+    assert not grabber.streams["Foo"].in_progress
+    assert "foo" in grabber.coordinator.waiting
+    await grabber.stop()
+
+
+async def test_queued_model_captured_elsewhere(loop):
+    backend = StoreLeaseBackend(MemoryLeaseStore())
+    hosts = []
+    for owner in ("host1", "host2"):
+        grabber = await MfcGrabber.create(
+            models=["A", "B"],
+            governor=CaptureGovernor(max_captures=1),
+            coordinator=LeaseCoordinator(backend, owner=owner),
+        )
+        grabber.server_config = {"h5video_servers": {"1": "video1"}}
+        for model_name in ("A", "B"):
+            grabber.streams[model_name] = IdleLoader(grabber.session, model_name)
+        hosts.append(grabber)
+    host1, host2 = hosts
+
+    await host1.handle_model(online("A"))
+    await host1.handle_model(online("B"))
+    await settle(host1)
+    assert host1.streams["A"].in_progress
+    assert host1.governor.is_pending(host1.streams["B"])
+    # only the running capture is leased
+    assert host1.coordinator.held == {"a"}
+
+    await host2.handle_model(online("B"))
+    await settle(host2)
+    assert host2.streams["B"].in_progress
+    assert host2.coordinator.held == {"b"}
+
+    # a slot frees up on host1, but b is taken
+    host1.governor.cancel(host1.streams["A"])
+    await settle(host1)
+    assert not host1.streams["B"].in_progress
+    assert "b" in host1.coordinator.waiting
+    assert host1.coordinator.held == set()
+    for grabber in hosts:
+        await grabber.stop()
+
+
+async def test_evict_idle_loaders(mfc_grabber: MfcGrabber):
+    for model in ("Foo", "Bar"):
+        payload = {"vs": 90, "nm": model, "uid": 321}
+        await mfc_grabber.handle_model(Message(10, 0, 0, 0, 0, payload=payload))
+    mfc_grabber.streams["Foo"].idle_since -= 1000
+    assert mfc_grabber.evict_idle_loaders() == 1
+    assert list(mfc_grabber.streams) == ["Bar"]
+    mfc_grabber.loader_idle_ttl = None
+    mfc_grabber.streams["Bar"].idle_since -= 1000
+    assert mfc_grabber.evict_idle_loaders() == 0
+
+
+async def test_stop_finishes_captures(tmp_path, loop):
+    storage = StorageManager(tmp_path)
+    finished = []
+    storage.finish = lambda *paths: finished.extend(paths)
+    grabber = await MfcGrabber.create(models=["Foo"], storage=storage)
+    grabber.server_config = {"h5video_servers": {"1": "video1"}}
+    grabber.streams["Foo"] = WritingLoader(grabber.session, "Foo", storage=storage)
+    await grabber.handle_model(online("Foo"))
+    await settle(grabber)
+    assert grabber.streams["Foo"].in_progress
+    await grabber.stop()
+    assert finished == [tmp_path / "Foo.mp4"]
+
+
+async def test_low_disk_space(tmp_path, loop):
+    backend = StoreLeaseBackend(MemoryLeaseStore())
+    storage = StorageManager(tmp_path)
+    grabber = await MfcGrabber.create(
+        models=["Foo", "Bar"],
+        governor=CaptureGovernor(max_captures=1),
+        coordinator=LeaseCoordinator(backend, owner="host1"),
+        storage=storage,
+    )
+    grabber.server_config = {"h5video_servers": {"1": "video1"}}
+    grabber.streams["Foo"] = FullDiskLoader(grabber.session, "Foo")
+    grabber.streams["Bar"] = IdleLoader(grabber.session, "Bar")
+    await grabber.handle_model(online("Foo"))
+    await settle(grabber)
+    await asyncio.sleep(0)
+    # foo ran out of space: no handover loop, the lease is free for others
+    assert "foo" not in grabber.coordinator.waiting
+    assert await backend.acquire("foo", "host2", 30)
+
+    storage.reserve_free_bytes = 2 ** 62
+    await grabber.handle_model(online("Bar"))
+    await settle(grabber)
+    assert not grabber.streams["Bar"].in_progress
+    assert grabber.coordinator.held == set()
+    assert grabber.governor.metrics["refused"] == 1
+    await grabber.stop()
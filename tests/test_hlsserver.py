@@ -0,0 +1,35 @@
+from aiohttp import ClientSession
+from myfreecams.hlsserver import HlsServer
+from myfreecams.streamloader import StreamLoader
+
+
+async def test_playlist_and_segments(aiohttp_client):
+    async with ClientSession() as session:
+        loader = StreamLoader(session, "test_model", buffer_segments=3)
+        for n in range(4):
+            loader.buffer_segment(f"segment{n}".encode(), 2.5)
+        loader.pending_discontinuity = True
+        loader.buffer_segment(b"segment4", 4.0)
+        streams = {"Test_Model": loader, "Idle": StreamLoader(session, "Idle")}
+        client = await aiohttp_client(HlsServer(streams).make_app())
+
+        resp = await client.get("/test_model/live.m3u8")
+        assert resp.status == 200
+        playlist = (await resp.text()).splitlines()
+        assert "#EXT-X-TARGETDURATION:4" in playlist
+        assert "#EXT-X-MEDIA-SEQUENCE:2" in playlist
+        assert playlist[-4:-1] == ["#EXT-X-DISCONTINUITY", "#EXTINF:4.000,", "4.ts"]
+        # not capturing, so players see a finished stream
+        assert playlist[-1] == "#EXT-X-ENDLIST"
+
+        resp = await client.get("/test_model/3.ts")
+        assert resp.status == 200
+        assert await resp.read() == b"segment3"
+        assert (await client.get("/test_model/1.ts")).status == 404
+        assert (await client.get("/test_model/5.ts")).status == 404
+        assert (await client.get("/idle/live.m3u8")).status == 404
+        assert (await client.get("/debug/profile")).status in (404, 405)
+
+        loader.buffer_segment(b"segment5", 2.0)
+        resp = await client.get("/test_model/live.m3u8")
+        assert "#EXT-X-MEDIA-SEQUENCE:3" in (await resp.text()).splitlines()
@@ -0,0 +1,74 @@
+import io
+import logging
+import threading
+from myfreecams.logsetup import RateLimitFilter, setup_logging, stop_logging
+
+
+def make_record(msg: str, *args, level: int = logging.WARNING) -> logging.LogRecord:
+    return logging.LogRecord("test", level, __file__, 1, msg, args, None)
+
+
+def test_rate_limit():
+    rate_limit = RateLimitFilter(interval=60)
+    assert rate_limit.filter(make_record("Foo: Cannot load video chunk"))
+    assert not rate_limit.filter(make_record("Foo: Cannot load video chunk"))
+    assert not rate_limit.filter(make_record("Foo: Cannot load video chunk"))
+    assert rate_limit.filter(make_record("Bar: Cannot load video chunk"))
+    assert rate_limit.filter(make_record("Foo: progress", level=logging.INFO))
+    assert rate_limit.filter(make_record("Foo: progress", level=logging.INFO))
+
+    # window expired: the next copy reports what was dropped
+    rate_limit.interval = 0
+    record = make_record("Foo: Cannot load video chunk")
+    assert rate_limit.filter(record)
+    assert record.getMessage().endswith("[2 repeats suppressed]")
+
+
+def test_rate_limit_templates():
+    rate_limit = RateLimitFilter(interval=60)
+    template = "%s: corrupt segment %s %s"
+    assert rate_limit.filter(make_record(template, "Foo", "media_1.ts", "report"))
+    # same problem on the same model, different details
+    assert not rate_limit.filter(make_record(template, "Foo", "media_2.ts", "x"))
+    assert rate_limit.filter(make_record(template, "Bar", "media_2.ts", "x"))
+    assert rate_limit.flush() == [
+        ("test", logging.WARNING, "Foo: corrupt segment media_2.ts x", 1)
+    ]
+
+
+def test_rate_limit_threads():
+    rate_limit = RateLimitFilter(interval=60)
+    errors = []
+
+    def log_many(thread: int):
+        # enough distinct models to make the filter prune while others log
+        try:
+            for i in range(3000):
+                model = f"model{thread}-{i % 600}"
+                rate_limit.filter(make_record("%s: %d segments missed", model, i))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=log_many, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert len(rate_limit.flush()) == 2400
+
+
+def test_setup_logging():
+    stream = io.StringIO()
+    setup_logging(rate_limit=60, stream=stream)
+    logger = logging.getLogger("myfreecams.test")
+    for i in range(3):
+        logger.warning("Foo: Cannot load chunklist")
+    logger.info("Foo: %s", "online")
+    stop_logging()
+    lines = stream.getvalue().splitlines()
+    assert lines == [
+        "WARNING:myfreecams.test:Foo: Cannot load chunklist",
+        "INFO:myfreecams.test:Foo: online",
+        "WARNING:myfreecams.test:Foo: Cannot load chunklist [2 repeats suppressed]",
+    ]
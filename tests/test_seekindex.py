@@ -0,0 +1,34 @@
+from pathlib import Path
+import pytest
+from myfreecams.seekindex import SeekIndex, SeekIndexWriter, IndexFormatError
+
+
+def test_roundtrip(tmp_path: Path):
+    path = tmp_path / "out.mp4.idx"
+    writer = SeekIndexWriter(path)
+    offset = 0
+    for i in range(10):
+        writer.add_segment(100 + i, 1000.0 + i, 1.0, offset, 1880, keyframes=[376])
+        offset += 1880
+    assert writer.accepts(110)
+    assert not writer.accepts(109) and not writer.accepts(5)
+    writer.close()
+    # truncated trailing record is ignored
+    with open(path, "ab") as fd:
+        fd.write(b"\x01\x02")
+
+    index = SeekIndex.load(path)
+    assert len(index) == 10
+    assert index.find_time(1004.5).sequence == 104
+    assert index.find_time(999) is None
+    assert index.find_sequence(107).offset == 7 * 1880
+    assert index.find_sequence(200) is None
+    assert index.find_offset(5000).sequence == 102
+    assert index.keyframe_before(5000) == 2 * 1880 + 376
+
+
+def test_bad_index(tmp_path: Path):
+    path = tmp_path / "bad.idx"
+    path.write_bytes(b"garbage")
+    with pytest.raises(IndexFormatError):
+        SeekIndex.load(path)
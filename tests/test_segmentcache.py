@@ -0,0 +1,21 @@
+from myfreecams.segmentcache import SegmentCache, get_chunk_name
+
+
+def test_chunk_name():
+    assert get_chunk_name("media_811.ts?nc=0.35") == "media_811.ts"
+    assert get_chunk_name("media_811.ts") == "media_811.ts"
+
+
+def test_bounded_cache():
+    cache = SegmentCache(maxlen=3)
+    for i in range(5):
+        cache.add_name(f"media_{i}.ts?nc={i}")
+        cache.add_fingerprint((i, i))
+    assert cache.seen_name("media_4.ts?nc=other")
+    assert not cache.seen_name("media_1.ts")
+    assert cache.seen_fingerprint((2, 2))
+    assert not cache.seen_fingerprint((0, 0))
+    assert len(cache.names) == len(cache.fingerprints) == 3
+    cache.forget_names()
+    assert not cache.seen_name("media_4.ts")
+    assert cache.seen_fingerprint((4, 4))
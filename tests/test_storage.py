@@ -0,0 +1,109 @@
+import asyncio
+import os
+from pathlib import Path
+import pytest
+from myfreecams.storage import OutputFile, StorageManager, StorageFullError
+
+
+def test_preallocated_output(tmp_path: Path):
+    path = tmp_path / "out.mp4"
+    output = OutputFile(path, preallocate=1024 * 1024)
+    assert output.write(b"a" * 100, duration=1.0) == 0
+    assert output.write(b"b" * 100, duration=1.0) == 100
+    # the reservation does not show up in the file size
+    assert os.stat(path).st_size == 200
+    if output.preallocate:
+        assert os.stat(path).st_blocks * 512 >= 1024 * 1024
+    output.close()
+    assert path.read_bytes() == b"a" * 100 + b"b" * 100
+
+    # reopening appends after the existing content
+    output = OutputFile(path, preallocate=1024)
+    assert output.write(b"c") == 200
+    output.close()
+    assert path.stat().st_size == 201
+
+
+def test_rotation(tmp_path: Path):
+    storage = StorageManager(tmp_path, max_file_size=250, max_file_duration=10)
+    output = storage.open_output("out.mp4")
+    assert not storage.should_rotate(output, 1000, 0)
+    output.write(b"a" * 200, duration=1)
+    assert storage.should_rotate(output, 100, 1)
+    assert not storage.should_rotate(output, 10, 1)
+    assert storage.should_rotate(output, 10, 9.5)
+    output.close()
+
+
+def test_free_space(tmp_path: Path):
+    storage = StorageManager(tmp_path, min_free_bytes=1, reserve_free_bytes=1)
+    storage.check_space()
+    assert storage.accepting_captures
+    storage = StorageManager(tmp_path, reserve_free_bytes=2 ** 62)
+    assert not storage.accepting_captures
+    storage.min_free_bytes = 2 ** 62
+    with pytest.raises(StorageFullError):
+        storage.check_space()
+
+
+async def test_mover(tmp_path: Path, loop):
+    storage = StorageManager(tmp_path / "work", archive_dir=tmp_path / "archive")
+    storage.start()
+    output = storage.open_output("out.mp4")
+    output.write(b"data")
+    output.close()
+    storage.finish(output.path)
+    await asyncio.sleep(0.1)
+    await storage.stop()
+    assert not output.path.exists()
+    assert (tmp_path / "archive" / "out.mp4").read_bytes() == b"data"
+
+
+async def test_mover_picks_up_leftovers(tmp_path: Path, loop):
+    work_dir = tmp_path / "work"
+    work_dir.mkdir()
+    old, fresh = work_dir / "old.mp4", work_dir / "fresh.mp4"
+    for path in (old, fresh, work_dir / "notes.txt"):
+        path.write_bytes(b"data")
+    os.utime(old, (0, 0))
+    storage = StorageManager(work_dir, archive_dir=tmp_path / "archive")
+    storage.start()
+    await asyncio.sleep(0.1)
+    await storage.stop()
+    assert [p.name for p in storage.archive_dir.iterdir()] == ["old.mp4"]
+    assert fresh.exists()
+
+
+def test_copy_between_devices(tmp_path: Path, monkeypatch):
+    storage = StorageManager(
+        tmp_path / "work", archive_dir=tmp_path / "archive", move_bytes_per_second=1e9
+    )
+    storage.archive_dir.mkdir()
+    output = storage.open_output("out.mp4")
+    output.write(b"x" * 3000000)
+    output.close()
+    path = output.path
+    monkeypatch.setattr(storage, "same_device", lambda path: False)
+    target = storage.move_file(path)
+    assert target.stat().st_size == 3000000
+    assert not path.exists()
+    assert not target.with_name("out.mp4.part").exists()
+
+
+async def test_stop_interrupts_copy(tmp_path: Path, monkeypatch, loop):
+    storage = StorageManager(
+        tmp_path / "work", archive_dir=tmp_path / "archive", move_bytes_per_second=1e6
+    )
+    output = storage.open_output("out.mp4")
+    output.write(b"x" * 3000000)
+    output.close()
+    monkeypatch.setattr(storage, "same_device", lambda path: False)
+    storage.start()
+    storage.finish(output.path)
+    await asyncio.sleep(0.2)
+    started = loop.time()
+    await storage.stop()
+    # the throttled copy would take three seconds
+    assert loop.time() - started < 1
+    assert output.path.exists()
+    assert list(storage.archive_dir.iterdir()) == []
@@ -1,31 +1,42 @@
 from pytest import fixture
 import pytest
-from aiohttp import web, ClientSession
+from aiohttp import web, ClientSession, ClientResponseError
 from myfreecams.streamloader import StreamLoader, PlaylistLoadError
+from myfreecams.seekindex import SeekIndex, get_index_filename
+from myfreecams.storage import StorageManager
+from myfreecams.diagnostics import timings
 import asyncio
 import random
 from pathlib import Path
 from pytest_aiohttp import TestServer
+from yarl import URL
 
 
 @fixture
-async def loader() -> StreamLoader:
-    loader = StreamLoader(ClientSession(raise_for_status=True), "test_model")
-    return loader
+async def loader(loop, tmp_path: Path) -> StreamLoader:
+    session = ClientSession(raise_for_status=True)
+    loader = StreamLoader(session, "test_model", storage=StorageManager(tmp_path))
+    yield loader
+    await stop(loader)
+    await session.close()
+
+
+async def stop(loader: StreamLoader):
+    task = loader.capture_task
+    loader.stop_capture()
+    if task is not None:
+        await asyncio.wait({task})
 
 
 async def test_loader(server: TestServer, loader: StreamLoader):
-    loader = StreamLoader(ClientSession(raise_for_status=True), "test_model")
     loader.start_capture(server.make_url("/playlist.m3u8"))
     assert loader.in_progress
+    out_file = loader.storage.get_path(loader.output_filename)
     await asyncio.sleep(3)
-    loader.stop_capture()
+    await stop(loader)
     assert not loader.in_progress
     assert loader.capture_task is None
-    if loader.output_filename is not None:
-        out_file = Path(loader.output_filename)
-        assert out_file.exists()
-        out_file.unlink()
+    assert out_file.exists()
 
 
 async def test_load_resource(server: TestServer, loader: StreamLoader):
@@ -41,3 +52,172 @@ async def test_load_playlist(server: TestServer, loader: StreamLoader):
 async def test_load_403_playlist(server: TestServer, loader: StreamLoader):
     with pytest.raises(PlaylistLoadError):
         await loader.load_playlist(server.make_url("/status403"))
+
+
+async def test_corrupt_segments_recorded(server: TestServer, loader: StreamLoader):
+    loader.start_capture(server.make_url("/playlist.m3u8"))
+    await asyncio.sleep(2)
+    out_file = loader.storage.get_path(loader.output_filename)
+    await stop(loader)
+    # test server chunks are not valid MPEG-TS
+    assert loader.verify_stats["verified"] > 0
+    assert loader.verify_stats["corrupt"] == loader.verify_stats["verified"]
+    assert loader.verify_stats["repaired"] == 0
+    index = SeekIndex.load(get_index_filename(out_file))
+    assert len(index) == loader.verify_stats["verified"]
+    last = index.segments[-1]
+    assert last.offset + last.size == out_file.stat().st_size
+
+
+async def test_start_index(loop, loader: StreamLoader):
+    with open("./tests/resources/chunklist.m3u8") as fd:
+        seq_number, total_duration, chunks = loader.parse_chunklist(fd.read())
+    assert seq_number == 811
+    assert len(chunks) == 5
+    assert chunks[0].duration == 0.767
+    assert loader.get_start_index(chunks) == 0
+    loader.start_policy = "live"
+    assert loader.get_start_index(chunks) == 4
+    loader.start_policy = 1.5
+    assert loader.get_start_index(chunks) == 3
+
+
+async def test_live_start_with_backlog(server: TestServer, loader: StreamLoader):
+    loader.start_policy = "live"
+    loader.fetch_backlog = True
+    loader.start_capture(server.make_url("/playlist.m3u8"))
+    await asyncio.sleep(2)
+    backlog_file = loader.storage.get_path(loader.get_backlog_filename())
+    await stop(loader)
+    assert loader.first_byte_delay is not None
+    assert loader.sequence_stats["resets"] == 0
+    # the four chunks before the live edge, indexed like live segments
+    backlog_index = SeekIndex.load(get_index_filename(backlog_file))
+    assert len(backlog_index) == 4
+    assert backlog_file.stat().st_size == sum(s.size for s in backlog_index.segments)
+
+
+class ScriptedLoader(StreamLoader):
+    def __init__(self, session, chunklists, output_dir: Path, failures=()):
+        super().__init__(session, "scripted")
+        self.chunklists = list(chunklists)
+        self.output_dir = output_dir
+        # chunk names that fail to download once
+        self.failures = set(failures)
+
+    def get_filename(self) -> str:
+        return str(self.output_dir / "scripted.mp4")
+
+    async def load_resource(self, url, raw=False):
+        url = URL(url)
+        if url.name == "playlist.m3u8":
+            return "chunklist.m3u8?nc=1\n"
+        if url.name == "chunklist.m3u8":
+            if not self.chunklists:
+                raise ClientResponseError(None, (), status=404)
+            return self.chunklists.pop(0)
+        if url.name in self.failures:
+            self.failures.remove(url.name)
+            raise ClientResponseError(None, (), status=503)
+        # the version query stands for new content under a reused name
+        return f"<{url.name}{url.query.get('v', '')}>".encode()
+
+
+def make_chunklist(
+    seq_number: int, prefix: str, count: int = 5, version: str = ""
+) -> str:
+    cl = f"#EXTM3U\n#EXT-X-MEDIA-SEQUENCE:{seq_number}\n"
+    query = f"nc=0.1&v={version}" if version else "nc=0.1"
+    for i in range(seq_number, seq_number + count):
+        cl += f"#EXTINF:0.1,\nmedia_{prefix}{i}.ts?{query}\n"
+    return cl
+
+
+async def test_sequence_reset(loop, tmp_path: Path):
+    chunklists = [
+        make_chunklist(100, "a"),
+        make_chunklist(102, "a"),
+        # edge restart: numbering starts over with new segment names
+        make_chunklist(5, "b"),
+        make_chunklist(5, "b", count=6),
+        # window jumped ahead
+        make_chunklist(20, "b", count=1),
+    ]
+    async with ClientSession() as session:
+        loader = ScriptedLoader(session, chunklists, tmp_path)
+        loader.start_capture("http://localhost/playlist.m3u8")
+        await loader.capture_task
+    outputs = sorted(tmp_path.glob("scripted*.mp4"))
+    expected = [
+        [f"a{i}" for i in range(100, 107)],
+        [f"b{i}" for i in range(5, 11)] + ["b20"],
+    ]
+    # the reset starts a new file, so each index keeps increasing sequences
+    for output, names in zip(outputs, expected):
+        assert output.read_text() == "".join(f"<media_{n}.ts>" for n in names)
+    assert len(outputs) == 2
+    index = SeekIndex.load(get_index_filename(outputs[1]))
+    assert index.find_sequence(6).offset == len("<media_b5.ts>")
+    assert loader.sequence_stats["resets"] == 1
+    assert loader.sequence_stats["missed"] == 9
+
+
+async def test_sequence_reset_reused_names(loop, tmp_path: Path):
+    chunklists = [
+        make_chunklist(100, "a"),
+        make_chunklist(105, "a"),
+        # edge restart: numbering drops back and old names carry new
+        # content, except for media_a108.ts which is served again as is
+        make_chunklist(102, "a", count=0)
+        + "#EXTINF:0.1,\nmedia_a108.ts?nc=0.2\n"
+        + make_chunklist(103, "a", count=5, version="2").split("\n", 2)[2],
+    ]
+    async with ClientSession() as session:
+        loader = ScriptedLoader(session, chunklists, tmp_path)
+        loader.start_capture("http://localhost/playlist.m3u8")
+        await loader.capture_task
+    outputs = sorted(tmp_path.glob("scripted*.mp4"))
+    assert len(outputs) == 2
+    assert outputs[0].read_text() == "".join(
+        f"<media_a{i}.ts>" for i in range(100, 110)
+    )
+    assert outputs[1].read_text() == "".join(
+        f"<media_a{i}.ts2>" for i in range(103, 108)
+    )
+    assert loader.sequence_stats["resets"] == 1
+    assert loader.sequence_stats["duplicates"] == 1
+
+
+async def test_failed_chunk(loop, tmp_path: Path):
+    chunklists = [make_chunklist(100, "a"), make_chunklist(101, "a")]
+    async with ClientSession() as session:
+        loader = ScriptedLoader(session, chunklists, tmp_path, {"media_a103.ts"})
+        written = timings["StreamLoader.write_segment"].calls
+        loader.start_capture("http://localhost/playlist.m3u8")
+        await loader.capture_task
+    # the per-segment work is timed, not the capture as a whole
+    assert timings["StreamLoader.write_segment"].calls == written + 5
+    outputs = sorted(tmp_path.glob("scripted*.mp4"))
+    assert len(outputs) == 1
+    names = ["a100", "a101", "a102", "a104", "a105"]
+    assert outputs[0].read_text() == "".join(f"<media_{n}.ts>" for n in names)
+    assert loader.sequence_stats["resets"] == 0
+    index = SeekIndex.load(get_index_filename(outputs[0]))
+    assert [entry.sequence for entry in index.segments] == [100, 101, 102, 104, 105]
+
+
+async def test_rotation(loop, tmp_path: Path):
+    chunklists = [make_chunklist(100, "a", count=3)]
+    async with ClientSession() as session:
+        loader = ScriptedLoader(session, chunklists, tmp_path)
+        loader.storage = StorageManager(tmp_path, max_file_size=30)
+        loader.start_capture("http://localhost/playlist.m3u8")
+        await loader.capture_task
+    outputs = sorted(tmp_path.glob("scripted*.mp4"))
+    assert [p.read_text() for p in outputs] == [
+        "<media_a100.ts><media_a101.ts>",
+        "<media_a102.ts>",
+    ]
+    for output in outputs:
+        index = SeekIndex.load(get_index_filename(output))
+        assert len(index) == output.stat().st_size // len("<media_a100.ts>")
@@ -0,0 +1,91 @@
+import random
+from myfreecams.tsverify import (
+    TS_PACKET_SIZE,
+    count_continuity_errors,
+    count_continuity_errors_fast,
+    verify_segment,
+)
+
+
+def ts_packet(pid: int, cc: int, payload: bool = True) -> bytes:
+    flags = (0x10 if payload else 0x20) | (cc & 0x0F)
+    header = bytes([0x47, (pid >> 8) & 0x1F, pid & 0xFF, flags])
+    if payload:
+        return header + b"\xff" * (TS_PACKET_SIZE - 4)
+    return header + bytes([TS_PACKET_SIZE - 5, 0]) + b"\xff" * (TS_PACKET_SIZE - 6)
+
+
+def test_valid_segment():
+    data = b"".join(ts_packet(0x100, cc) for cc in range(20))
+    data += ts_packet(0x101, 7) + ts_packet(0x101, 7, payload=False)
+    report = verify_segment(data)
+    assert report.ok
+    assert report.packets == 22
+
+
+def test_truncated_segment():
+    data = b"".join(ts_packet(0x100, cc) for cc in range(3))
+    report = verify_segment(data[:-10])
+    assert report.misaligned
+    assert not report.ok
+    assert not verify_segment(b"").ok
+
+
+def test_sync_loss():
+    packets = [ts_packet(0x100, cc) for cc in range(3)]
+    packets[1] = b"\x00" + packets[1][1:]
+    assert verify_segment(b"".join(packets)).sync_errors == 1
+
+
+def test_continuity_gap():
+    data = b"".join(ts_packet(0x100, cc) for cc in (0, 1, 2, 5, 6))
+    report = verify_segment(data)
+    assert report.continuity_errors == 1
+    assert not report.ok
+
+
+def pes_start(pid: int, cc: int, stream_id: int) -> bytes:
+    packet = bytearray(ts_packet(pid, cc))
+    packet[1] |= 0x40  # payload_unit_start_indicator
+    packet[3] |= 0x20  # adaptation field and payload
+    packet[4:6] = bytes([1, 0x40])  # random_access_indicator
+    packet[6:10] = b"\x00\x00\x01" + bytes([stream_id])
+    return bytes(packet)
+
+
+def test_keyframes():
+    data = (
+        ts_packet(0x100, 0)
+        + pes_start(0x101, 0, 0xC0)  # audio
+        + pes_start(0x100, 1, 0xE0)
+        + ts_packet(0x100, 2)
+        + pes_start(0x101, 1, 0xC0)
+    )
+    report = verify_segment(data)
+    assert report.ok
+    assert report.keyframes == [2 * TS_PACKET_SIZE]
+
+
+def test_fast_continuity_matches_reference():
+    rng = random.Random(1)
+    for _ in range(200):
+        pids = rng.sample([0, 0x11, 0x100, 0x101, 0x1000, 0x1FFF], rng.randint(1, 6))
+        counters = {pid: rng.randint(0, 15) for pid in pids}
+        packets = []
+        for _ in range(rng.randint(1, 100)):
+            pid = rng.choice(pids)
+            # mostly in order, some repeats and gaps
+            counters[pid] += rng.choice((1, 1, 1, 1, 1, 1, 0, 3))
+            packets.append(ts_packet(pid, counters[pid], payload=rng.random() > 0.1))
+        data = b"".join(packets)
+        expected = count_continuity_errors(memoryview(data))
+        assert count_continuity_errors_fast(data, len(packets)) == expected
+        assert verify_segment(data).continuity_errors == expected
+
+
+def test_discontinuity_indicator():
+    reset = bytearray(ts_packet(0x100, 9, payload=False))
+    reset[3] |= 0x10
+    reset[5] = 0x80  # discontinuity_indicator
+    data = ts_packet(0x100, 0) + bytes(reset) + ts_packet(0x100, 10)
+    assert verify_segment(data).ok